@@ -6,24 +6,20 @@ import re
 from dateutil import parser
 
 from langchain_qdrant import Qdrant
-from langchain_community import embeddings
-from langchain_community.chat_models import ChatOllama
 from langchain.docstore.document import Document
 from langchain_community.document_loaders import DirectoryLoader
-from langchain_community.chat_models import ChatOllama
-from langchain.docstore.document import Document
 from langchain_text_splitters import MarkdownHeaderTextSplitter
 
+from utilities import get_chat_model, get_embeddings
+
 
 import langchain
 
 # langchain.debug = True
 
-llm = ChatOllama(model=config.llm_model, base_url=config.llm_url, keep_alive=-1)
+llm = get_chat_model(config.llm_model, keep_alive=-1)
 
-embedding_function = embeddings.OllamaEmbeddings(
-    model=config.llm_embeddings_model, base_url=config.llm_url
-)
+embedding_function = get_embeddings(prefixed=True)
 
 
 # Define the metadata extraction function.
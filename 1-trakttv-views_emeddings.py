@@ -28,10 +28,9 @@ import sys
 import time
 
 from dateutil import parser
-from langchain_community.embeddings import OllamaEmbeddings
 
 import config
-from utilities import load_json, make_document, save_doc
+from utilities import get_embeddings, load_json, make_document, save_doc
 
 if __name__ == "__main__":
     arg_parser = argparse.ArgumentParser(
@@ -45,10 +44,7 @@ if __name__ == "__main__":
         print(f"{args.input_file} not found")
         sys.exit(1)
 
-    embeddings = OllamaEmbeddings(
-        model=config.llm_embeddings_model,
-        base_url=config.llm_url,
-    )
+    embeddings = get_embeddings(prefixed=True)
 
     json_blob = load_json(args.input_file)
 
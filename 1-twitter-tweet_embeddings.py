@@ -31,10 +31,9 @@ import time
 import zipfile
 
 from langchain.docstore.document import Document
-from langchain_community.embeddings import OllamaEmbeddings
 
 import config
-from utilities import save_doc
+from utilities import get_embeddings, save_doc
 
 
 def uncompress(twitterfile=False, default_file=False):
@@ -95,10 +94,7 @@ def make_document(doc_date=False, id_hash=False, content=False):
 
 
 if __name__ == "__main__":
-    embeddings = OllamaEmbeddings(
-        model=config.llm_embeddings_model,
-        base_url=config.llm_url,
-    )
+    embeddings = get_embeddings(prefixed=True)
 
     argparser = argparse.ArgumentParser(description="Parse and ingest twitter data.")
     argparser.add_argument(
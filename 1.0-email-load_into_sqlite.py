@@ -2,33 +2,45 @@
 """
 What it does:
 
-This script removes all attachments from a mailbox file (.mbox)
-and writes the resulting plain text content to a new output file.
-The original message headers, including sender information, /e preserved.
+This script loads mailbox files (.mbox) into the SQLite email DB
+(config.sqlite_email_file). Attachments are dropped, HTML is turned
+into text and signatures and quoted replies are cut off, so only the
+textual part of each email is kept. The original message headers,
+including sender information, are preserved.
 
-In essence, this script is a simple mailbox filter that extracts
-and preserves only the textual parts of emails in a mailbox file,
-discarding any attachments.
+Every message goes into raw_msgs. Mail you sent, and mail from people
+you've sent mail to, goes into msgs for the later stages. A re-run only
+reads what was appended to a file since it was last imported.
 
 Inputs:
 
-    A .mbox file to process (input_file)
-    A desired output file name (output_file)
+    input_files              One or more .mbox files, directories of them or glob patterns
+    --workers N              Processes to parse and clean messages in. Default 1 (no pool).
+    --no-index               Don't read or write the <mbox file>.idx message offset index.
+    --full                   Re-import whole files, even the parts already imported.
+    --batch-size N           Messages written per transaction. Default 500.
+    --persist-address-cache  Keep email address validation results in the DB between runs.
 
 Outputs:
 
-    A new .mbox file with only the plain text content of the input messages
+    The raw_msgs, msgs, address_book, msg_ids and mbox_manifest tables,
+    and a per-file throughput summary.
 """
 
 import argparse
 import errno
+import glob
 import mailbox
 import os
 import sys
 import sqlite3
-import base64
 import re
 import datetime
+import hashlib
+import multiprocessing
+import time
+from html.parser import HTMLParser
+from typing import List, Optional, Tuple
 
 from bs4 import BeautifulSoup
 from dateutil import parser
@@ -38,12 +50,67 @@ from rich.console import Console
 from rich.style import Style
 
 import config
-from utilities import remove_non_ascii, parse_people2, remove_null_chars, table_exists
+from email_store import compress_text, connect, encode_headers, payload_codec
+from mbox_reader import MboxReader, from_line, header_block, message_from_bytes
+from utilities import (
+    AddressCache,
+    SignatureStripper,
+    normalize_address,
+    parse_people2,
+    remove_non_ascii,
+    remove_null_chars,
+    table_exists,
+)
+
+DB_NAME1 = "msgs"
+DB_NAME2 = "raw_msgs"
+MSG_IDS_TABLE = "msg_ids"
+# Messages handed to a worker at a time. Keeps pickling overhead down without
+# holding too much of the mbox in flight.
+WORKER_CHUNKSIZE = 16
+
+signature_stripper = SignatureStripper()
+address_cache = AddressCache()
+
+# "fast" uses HTMLTextExtractor, "bs4" is the old BeautifulSoup path.
+HTML_PARSER = getattr(config, "email_html_parser", "fast")
+# Tags or character references. Anything else goes through as plain text.
+HTML_SNIFF_PATTERN = re.compile(r"<[a-zA-Z!/?]|&(?:#[0-9xX]|[a-zA-Z])")
+
+
+class EmailRecord:
+    """
+    A message on its way through the cleaning steps in process_message. The
+    body is one decoded string, so each step is a string operation instead of
+    a set_payload() on a mailbox message.
+
+    sender and receiver are (name, address) tuples, headers are [name, value] pairs.
+    """
+
+    __slots__ = ("from_line", "date", "sender", "receiver", "subject", "headers", "body")
+
+    def __init__(
+        self,
+        from_line: str,
+        date: Optional[datetime.datetime],
+        sender: Optional[tuple],
+        receiver: Optional[tuple],
+        subject: Optional[str],
+        headers: list,
+        body: str,
+    ):
+        self.from_line = from_line
+        self.date = date
+        self.sender = sender
+        self.receiver = receiver
+        self.subject = subject
+        self.headers = headers
+        self.body = body
 
 
 def extract_text_from_message(
     original_message: mailbox.mboxMessage,
-) -> mailbox.mboxMessage:
+) -> EmailRecord:
     """
     Extracts only the plain text content from a mailbox message object, removing attachments.
 
@@ -51,17 +118,10 @@ def extract_text_from_message(
         original_message (mailbox.Message): The mailbox message object to process.
 
     Returns:
-        mailbox.Message: A new message object containing only the plain text content.
+        EmailRecord: The message's from line, date, subject and headers, and its
+        text/plain parts as the body. sender and receiver are left for the caller.
     """
-
-    # Create a new message object to store the text content
-    new_message = mailbox.mboxMessage()
-
-    # Copy headers from the original message to the new message
-    for header, value in original_message.items():
-        new_message[header] = value
-    new_message.set_from(original_message.get_from())
-    # Extract text parts and append them to the new message
+    # Extract text parts and join them into the body
     text_parts = []
     for part in original_message.walk():
         if part.get_content_type() == "text/plain":
@@ -72,10 +132,17 @@ def extract_text_from_message(
             cleaned_payload = remove_null_chars(remove_non_ascii(decoded_payload))
             text_parts.append(cleaned_payload)
 
-    # Set the payload of the new message to the combined text parts
-    new_message.set_payload("\n".join(text_parts))
-
-    return new_message
+    subject = original_message["subject"]
+    return EmailRecord(
+        from_line=original_message.get_from(),
+        date=parse_date_from_from_header(original_message.get_from()),
+        sender=None,
+        receiver=None,
+        # Header objects don't survive the trip back from a worker, plain strings do.
+        subject=str(subject) if subject is not None else None,
+        headers=parse_headers(original_message.items()),
+        body="\n".join(text_parts),
+    )
 
 
 def create_tables():
@@ -83,7 +150,7 @@ def create_tables():
     cursor = connection.cursor()
     sql = "CREATE TABLE msgs (id INTEGER PRIMARY KEY AUTOINCREMENT, from_line TEXT UNIQUE, msg_date TIMESTAMP, sender TEXT, receiver TEXT, subject TEXT, headers TEXT, payload TEXT)"
     cursor.execute(sql)
-    sql = "CREATE TABLE raw_msgs (id INTEGER PRIMARY KEY AUTOINCREMENT, from_line TEXT UNIQUE, msg_date TIMESTAMP, sender TEXT, receiver TEXT, subject TEXT, headers TEXT, payload TEXT)"
+    sql = "CREATE TABLE raw_msgs (id INTEGER PRIMARY KEY AUTOINCREMENT, from_line TEXT UNIQUE, msg_date TIMESTAMP, sender TEXT, receiver TEXT, subject TEXT, headers TEXT, payload TEXT, sender_norm TEXT)"
     cursor.execute(sql)
     sql = "CREATE INDEX index_msg_from ON msgs (from_line);"
     cursor.execute(sql)
@@ -91,6 +158,8 @@ def create_tables():
     cursor.execute(sql)
     sql = "CREATE INDEX index_sender ON raw_msgs (sender);"
     cursor.execute(sql)
+    sql = "CREATE INDEX index_sender_norm ON raw_msgs (sender_norm);"
+    cursor.execute(sql)
     sql = "CREATE TABLE address_book (id INTEGER PRIMARY KEY AUTOINCREMENT, email_addr TEXT UNIQUE, display_name TEXT)"
     cursor.execute(sql)
     sql = "CREATE INDEX index_address ON address_book (email_addr);"
@@ -98,40 +167,343 @@ def create_tables():
     connection.close()
 
 
-def write_msg_to_db(
-    from_header: str,
-    msg_date: datetime,
-    sender: str,
-    receiver: str,
-    subject: str,
-    headers: str,
-    payload: str,
-    table_name: str,
-    connection: sqlite3.Connection,
-) -> bool:
+def add_sender_norm(connection: sqlite3.Connection):
+    """Adds and backfills raw_msgs.sender_norm on DBs created before it existed."""
     cursor = connection.cursor()
-    stripped_payload = payload.replace("\n", "").replace("\r", "").replace('"', "'")
-    if subject is not None:
-        stripped_subject = (
-            str(subject).replace("\n", "").replace("\r", "").replace('"', "'")
+    columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({DB_NAME2})")]
+    if "sender_norm" not in columns:
+        print("Adding sender_norm to raw_msgs")
+        cursor.execute(f"ALTER TABLE {DB_NAME2} ADD COLUMN sender_norm TEXT")
+        cursor.execute(f"UPDATE {DB_NAME2} SET sender_norm = lower(trim(sender))")
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS index_sender_norm ON {DB_NAME2} (sender_norm)"
         )
-    else:
-        stripped_subject = ["None"]
-    sql = f'INSERT INTO {table_name} (from_line, msg_date, sender, receiver, subject, headers, payload) VALUES  ("{from_header}", "{msg_date}", "{sender}", "{receiver}", "{stripped_subject}", "{headers}", "{stripped_payload}")'
-    # print(sql)
-    try:
-        cursor.execute(sql)
-    except sqlite3.IntegrityError as e:
-        if (
-            hasattr(e, "sqlite_errorname")
-            and "SQLITE_CONSTRAINT_UNIQUE" in e.sqlite_errorname
-        ):
-            print(f"Record already exists. {e}")
-            # print(sql)
+        connection.commit()
+    cursor.close()
+
+
+def load_manifest(connection: sqlite3.Connection, mbox_file: str) -> Optional[tuple]:
+    """
+    Returns (size, fingerprint, last_offset, messages) from the last completed
+    import of mbox_file, or None if it hasn't been imported.
+    """
+    cursor = connection.cursor()
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS mbox_manifest (mbox_file TEXT PRIMARY KEY, size INTEGER, fingerprint TEXT, last_offset INTEGER, messages INTEGER, updated TIMESTAMP)"
+    )
+    cursor.execute(
+        "SELECT size, fingerprint, last_offset, messages FROM mbox_manifest WHERE mbox_file = ?",
+        (os.path.realpath(mbox_file),),
+    )
+    manifest = cursor.fetchone()
+    cursor.close()
+    return manifest
+
+
+def save_manifest(
+    connection: sqlite3.Connection,
+    mbox_file: str,
+    size: int,
+    fingerprint: str,
+    last_offset: int,
+    messages: int,
+):
+    sql = "INSERT OR REPLACE INTO mbox_manifest (mbox_file, size, fingerprint, last_offset, messages, updated) VALUES (?, ?, ?, ?, ?, ?)"
+    connection.execute(
+        sql,
+        (
+            os.path.realpath(mbox_file),
+            size,
+            fingerprint,
+            last_offset,
+            messages,
+            str(datetime.datetime.now()),
+        ),
+    )
+    connection.commit()
+
+
+def resume_offset(reader: MboxReader, manifest: Optional[tuple]) -> int:
+    """
+    Where to start reading given the manifest from the last import. Only skips
+    ahead if the file up to the old high-water mark is unchanged, i.e. it was
+    only appended to.
+    """
+    if manifest is None:
+        return 0
+    size, fingerprint, last_offset, messages = manifest
+    if reader.size < last_offset or reader.fingerprint(last_offset) != fingerprint:
+        print("mbox changed since the last import, re-importing all of it")
+        return 0
+    return last_offset
+
+
+class HighWaterMark:
+    """Follows the offsets handed out for processing, so the manifest knows how far we got."""
+
+    def __init__(self, offset: int = 0):
+        self.offset = offset
+        self.count = 0
+
+    def track(self, offsets):
+        for start, stop in offsets:
+            self.offset = stop
+            self.count += 1
+            yield start, stop
+
+
+def expand_inputs(paths: List[str]) -> List[str]:
+    """
+    Turns the command line inputs into mbox files. Directories give the *.mbox
+    files in them, and anything else is treated as a glob pattern. Each file is
+    listed once, in the order given.
+    """
+    mbox_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            matches = sorted(glob.glob(os.path.join(path, "*.mbox")))
+        elif os.path.isfile(path):
+            matches = [path]
         else:
-            print(e)
+            matches = sorted(glob.glob(path))
+        for mbox_file in matches:
+            if os.path.isfile(mbox_file) and mbox_file not in mbox_files:
+                mbox_files.append(mbox_file)
+    return mbox_files
+
+
+class MboxImport:
+    """
+    One input mbox: its reader, where this run starts in it and the numbers
+    for the throughput summary.
+    """
+
+    def __init__(self, mbox_file: str, connection: sqlite3.Connection, use_index: bool, full: bool):
+        self.mbox_file = mbox_file
+        self.reader = MboxReader(mbox_file, use_index=use_index)
+        self.manifest = load_manifest(connection=connection, mbox_file=mbox_file)
+        self.start_offset = 0 if full else resume_offset(reader=self.reader, manifest=self.manifest)
+        self.high_water = HighWaterMark(offset=self.start_offset)
+        self.stored = 0
+        self.skipped = 0
+        # Skipped by triage_message, so never body-decoded
+        self.skipped_bytes = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def offsets(self):
+        return self.high_water.track(self.reader.iter_offsets(start=self.start_offset))
+
+    def save_manifest(self, connection: sqlite3.Connection):
+        """Only call once everything is committed, so a crashed run is simply redone."""
+        previous_messages = self.manifest[3] if self.start_offset else 0
+        save_manifest(
+            connection=connection,
+            mbox_file=self.mbox_file,
+            size=self.reader.size,
+            fingerprint=self.reader.fingerprint(self.high_water.offset),
+            last_offset=self.high_water.offset,
+            messages=previous_messages + self.high_water.count,
+        )
+
+    def summary(self) -> str:
+        seconds = max(self.seconds, 1e-9)
+        return (
+            f"{self.mbox_file}: {self.high_water.count} messages, {self.stored} stored, "
+            f"{self.skipped} skipped, {self.bytes / 1048576:.1f}MB in {self.seconds:.1f}s "
+            f"({self.high_water.count / seconds:.0f} msgs/s, {self.bytes / 1048576 / seconds:.1f}MB/s)"
+        )
+
+
+def create_msg_ids_table(connection: sqlite3.Connection):
+    connection.execute(
+        f"CREATE TABLE IF NOT EXISTS {MSG_IDS_TABLE} (msg_key TEXT PRIMARY KEY, from_line TEXT)"
+    )
+    connection.commit()
+
+
+def message_key(message: mailbox.mboxMessage) -> str:
+    """
+    Identifies a message across archives using its headers only. The Message-ID
+    if there is one, otherwise a hash of the addressing, date and subject headers.
+    """
+    msg_id = str(message.get("message-id", "")).strip()
+    if msg_id:
+        return f"mid:{msg_id}"
+    header_values = "\0".join(
+        str(message.get(header, ""))
+        for header in ("from", "to", "cc", "date", "subject", "in-reply-to")
+    )
+    return f"hash:{hashlib.sha256(header_values.encode('utf-8', errors='replace')).hexdigest()}"
+
+
+class SeenMessages:
+    """
+    Answers "was this message already imported?" from msg_ids plus the keys
+    stored during this run. Pool workers get a read-only connection of their own.
+    """
+
+    def __init__(self, connection: sqlite3.Connection = None):
+        self.connection = connection
+        self.keys = set()
+        self.duplicates = 0
+
+    def seen(self, msg_key: str) -> bool:
+        if msg_key in self.keys:
+            return True
+        if self.connection is None:
+            return False
+        cursor = self.connection.execute(
+            f"SELECT 1 FROM {MSG_IDS_TABLE} WHERE msg_key = ? LIMIT 1", (msg_key,)
+        )
+        return cursor.fetchone() is not None
+
+    def skip_if_seen(self, msg_key: str) -> bool:
+        if self.seen(msg_key):
+            self.duplicates += 1
+            return True
+        return False
+
+    def drain(self) -> int:
+        duplicates, self.duplicates = self.duplicates, 0
+        return duplicates
+
+
+seen_messages = SeenMessages()
+
+
+class MsgWriter:
+    """
+    Buffers rows for msgs/raw_msgs and writes them with executemany,
+    one transaction per batch_size messages.
+
+    Rows that hit the UNIQUE from_line constraint are skipped and counted
+    as duplicates instead of failing the batch. Payloads and headers are
+    compressed with codec (see email_store.py) if one is given.
+    """
+
+    def __init__(
+        self,
+        connection: sqlite3.Connection,
+        batch_size: int = 500,
+        codec: Optional[str] = None,
+    ):
+        self.connection = connection
+        self.batch_size = batch_size
+        self.codec = codec
+        self.pending = {}
+        self.pending_count = 0
+        self.inserted = {}
+        self.duplicates = {}
+
+    def add(
+        self,
+        from_header: str,
+        msg_date: datetime,
+        sender: str,
+        receiver: str,
+        subject: str,
+        headers: str,
+        payload: str,
+        table_name: str,
+    ):
+        stripped_payload = payload.replace("\n", "").replace("\r", "")
+        if subject is not None:
+            subject = str(subject).replace("\n", "").replace("\r", "")
+        row = (
+            from_header,
+            str(msg_date),
+            sender,
+            receiver,
+            subject,
+            compress_text(encode_headers(headers), self.codec),
+            compress_text(stripped_payload, self.codec),
+        )
+        if table_name == DB_NAME2:
+            row += (normalize_address(sender),)
+        self.pending.setdefault(table_name, []).append(row)
+        self.pending_count += 1
+        if self.pending_count >= self.batch_size:
+            self.flush()
+
+    def add_msg_key(self, msg_key: str, from_header: str):
+        """Records a message's key in msg_ids, committed with the message itself."""
+        self.pending.setdefault(MSG_IDS_TABLE, []).append((msg_key, from_header))
+
+    def flush(self):
+        if not self.pending_count:
+            return
+        cursor = self.connection.cursor()
+        for table_name, rows in self.pending.items():
+            if table_name == DB_NAME2:
+                sql = f"INSERT OR IGNORE INTO {table_name} (from_line, msg_date, sender, receiver, subject, headers, payload, sender_norm) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+            elif table_name == MSG_IDS_TABLE:
+                sql = f"INSERT OR IGNORE INTO {table_name} (msg_key, from_line) VALUES (?, ?)"
+            else:
+                sql = f"INSERT OR IGNORE INTO {table_name} (from_line, msg_date, sender, receiver, subject, headers, payload) VALUES (?, ?, ?, ?, ?, ?, ?)"
+            before = self.connection.total_changes
+            cursor.executemany(sql, rows)
+            inserted = self.connection.total_changes - before
+            self.inserted[table_name] = self.inserted.get(table_name, 0) + inserted
+            self.duplicates[table_name] = (
+                self.duplicates.get(table_name, 0) + len(rows) - inserted
+            )
+        self.connection.commit()
+        cursor.close()
+        self.pending = {}
+        self.pending_count = 0
+
+    def report(self) -> List[str]:
+        return [
+            f"{table_name}: {self.inserted[table_name]} inserted, {self.duplicates[table_name]} duplicates"
+            for table_name in self.inserted
+        ]
+
+
+def promote_recipients(recipients_list: dict, connection: sqlite3.Connection) -> int:
+    """
+    Copies every raw_msgs row sent by someone in recipients_list into msgs.
+
+    One INSERT...SELECT joined on the indexed sender_norm column, so it's a
+    single pass over raw_msgs no matter how many recipients there are.
+
+    Returns:
+        int: The number of messages added to msgs.
+    """
+    cursor = connection.cursor()
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS recipients (email_addr TEXT PRIMARY KEY)")
+    cursor.execute("DELETE FROM temp.recipients")
+    cursor.executemany(
+        "INSERT OR IGNORE INTO temp.recipients (email_addr) VALUES (?)",
+        [(normalize_address(recipient),) for recipient in recipients_list],
+    )
+    before = connection.total_changes
+    cursor.execute(
+        f"""INSERT OR IGNORE INTO {DB_NAME1} (from_line, msg_date, sender, receiver, subject, headers, payload)
+        SELECT r.from_line, r.msg_date, r.sender, r.receiver, r.subject, r.headers, r.payload
+        FROM {DB_NAME2} r JOIN temp.recipients t ON r.sender_norm = t.email_addr
+        ORDER BY r.id"""
+    )
+    promoted = connection.total_changes - before
     connection.commit()
     cursor.close()
+    return promoted
+
+
+def load_recipients(connection: sqlite3.Connection) -> dict:
+    """Everyone already in raw_msgs that one of your addresses has sent mail to."""
+    my_addrs = [normalize_address(addr) for addr in config.emails_dict]
+    if not my_addrs:
+        return {}
+    placeholders = ", ".join("?" * len(my_addrs))
+    cursor = connection.cursor()
+    cursor.execute(
+        f"SELECT DISTINCT receiver FROM {DB_NAME2} WHERE sender_norm IN ({placeholders})",
+        my_addrs,
+    )
+    recipients_list = {receiver: "" for (receiver,) in cursor.fetchall()}
+    cursor.close()
+    return recipients_list
 
 
 def add_recipient(
@@ -151,67 +523,71 @@ def add_recipient(
 
 
 def parse_headers(headers: list) -> list:
+    """All the headers as [name, value] pairs, ready for encode_headers."""
     if headers is not None:
-        stripped_headers = []
-        for k, v in headers:
-            stripped_headers.append(
-                (f"{k}:{v},").replace("\n", "").replace("\r", "").replace('"', "'")
-            )
-            return stripped_headers
+        return [[k, str(v)] for k, v in headers]
     else:
-        return ["None"]
+        return []
+
+
+class HTMLTextExtractor(HTMLParser):
+    """Streaming tag stripper. Keeps the text, drops tags, comments, scripts and styles."""
 
+    skip_tags = ("script", "style")
 
-def strip_html(message_payload):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.skip_tags:
+            self.skip_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag in self.skip_tags and self.skip_depth:
+            self.skip_depth -= 1
+
+    def handle_data(self, data):
+        if not self.skip_depth:
+            self.parts.append(data)
+
+
+def has_markup(message_payload: str) -> bool:
+    return HTML_SNIFF_PATTERN.search(message_payload) is not None
+
+
+def strip_html_bs4(message_payload):
     soup = BeautifulSoup(message_payload, "html.parser", from_encoding="utf-8")
     return soup.text
 
 
-def clean_up_msg(message=False):
-    lines = message.get_payload().split("\n")
-    cleaned_lines = []
-
-    for line in lines:
-        flag = False
-        if re.match(r".*--.*Original Message.*--.*", line):
-            print('Removign "Original Message"')
-            flag = True
-            break
-        if re.match(r"On.*wrote:", line):
-            print('Removing "On...wrote:"')
-            flag = True
-            break
-        if re.match(r".*--.*Forwarded Message.*--.*", line):
-            print('Removing "Forward Message"')
-            flag = True
-            break
-        if line.startswith("--"):
-            print("Removing sig")
-            flag = True
-            break  # Exit the loop when "-- " is found
-        if line.startswith("m!"):
-            print("Removing m!")
-            flag = True
-            break
-        if re.match(r"^ttul,$", line):
-            print('Removing "ttul"')
-            flag = True
-            break
-        if line.startswith("k;"):
-            print("Removing k;")
-            flag = True
-            break
-        if re.match(r"^Cheers$", line):
-            print('Removing "ttul"')
-            flag = True
-            break
-        cleaned_lines.append(line)
-
-    cleaned_string = "\n".join(cleaned_lines)
-
-    message.set_payload(cleaned_string)
-
-    return message, flag
+def strip_html(message_payload: str) -> Tuple[str, str]:
+    """
+    Removes HTML from a payload. Payloads without tags or entities are returned
+    as is, which is most of them once extract_text_from_message is done.
+
+    Returns:
+        tuple: The text, and which path was taken ("plain", "fast" or "bs4").
+    """
+    if not has_markup(message_payload):
+        return message_payload, "plain"
+    if HTML_PARSER == "bs4":
+        return strip_html_bs4(message_payload), "bs4"
+    extractor = HTMLTextExtractor()
+    extractor.feed(message_payload)
+    extractor.close()
+    return "".join(extractor.parts), "fast"
+
+
+def clean_up_msg(message: EmailRecord) -> EmailRecord:
+    """Cuts the body at the first signature/reply/forward line in one pass."""
+    cleaned_string, rule_name = signature_stripper.strip(message.body)
+    if rule_name is not None:
+        print(f'Removing "{rule_name}"')
+        message.body = cleaned_string
+
+    return message
 
 
 def parse_date_from_from_header(text):
@@ -265,204 +641,442 @@ def update_email_record(
 def add_address(
         email_addr: str,
         display_name: str,
-        table_name: str,
-        connection: sqlite3.Connection,
-    ):
+        address_book: dict,
+    ) -> dict:
+    """
+    Records an address in the in-memory address book. Same rule as
+    add_recipient, the longest display name wins. Written out by write_address_book.
+    """
 
     #Email is so dirty
     email_addr = email_addr.replace('"', "").replace("'","")
     display_name = display_name.replace('"', "").replace("'","")
-    
+
     #Don't add emails with no display name or the display name is the email address.
     if display_name and email_addr not in display_name:
-        sql = f"SELECT * FROM {table_name} WHERE email_addr LIKE '%{email_addr}%'"
-        # print(sql)
-        cursor = connection.cursor()
-        cursor.execute(sql)
-        result = cursor.fetchone()
-        #If there is a record and diplay_name recorded isn't smaller
-        if result and not len(result[2]) < len(display_name):
-            # console.print(f"Record for {email_addr} exists.")
-            return(False)
-
-        # #If the display name is bigger use the bigger one.
-        # elif result and len(result[2]) < len(display_name):
-        #     print(result)
-        #     update_email_record(table_name=table_name,
-        #                         column="display_name" ,
-        #                         payload=display_name,
-        #                         row_id=result[0],
-        #                         connection=connection)
-        else:
-            sql = f'INSERT INTO {table_name} (email_addr, display_name) VALUES  ("{email_addr}", "{display_name}")'
-
-            try:
-                cursor.execute(sql)
-            except sqlite3.IntegrityError as e:
-                if (
-                    hasattr(e, "sqlite_errorname")
-                    and "SQLITE_CONSTRAINT_UNIQUE" in e.sqlite_errorname
-                ):
-                    print(f"Record already exists. {e}")
-                    # print(sql)
-                else:
-                    print(e)
-        connection.commit()
-        cursor.close()
+        if email_addr not in address_book or len(display_name) > len(address_book[email_addr]):
+            address_book[email_addr] = display_name
+
+    return address_book
+
+
+def write_address_book(
+        address_book: dict,
+        table_name: str,
+        connection: sqlite3.Connection,
+    ) -> int:
+    """
+    Upserts the in-memory address book in one transaction. A name already in
+    the DB is only replaced by a longer one, so re-runs keep the longest name seen.
+
+    Returns:
+        int: The number of rows inserted or updated.
+    """
+    sql = f"""INSERT INTO {table_name} (email_addr, display_name) VALUES (?, ?)
+        ON CONFLICT(email_addr) DO UPDATE SET display_name = excluded.display_name
+        WHERE length(excluded.display_name) > length(coalesce({table_name}.display_name, ''))"""
+    cursor = connection.cursor()
+    before = connection.total_changes
+    cursor.executemany(sql, address_book.items())
+    changed = connection.total_changes - before
+    connection.commit()
+    cursor.close()
+    return changed
+
+
+def triage_message(headers: mailbox.mboxMessage) -> Optional[tuple]:
+    """
+    Applies every skip rule using only the headers, so skipped messages never
+    have their bodies or attachments decoded.
+
+    Args:
+        headers (mailbox.mboxMessage): The message, or just its header block.
+
+    Returns:
+        tuple: (msg_key, sender, receiver) for messages worth processing, or None.
+    """
+    # Add your exceptions here, for problematic messages...
+    if "X-Gmail-Labels" in headers and (
+        "Chat" in headers["X-Gmail-Labels"]
+        or "Spam" in headers["X-Gmail-Labels"]
+        or (
+            headers["subject"] is not None
+            and "SQL dump -" in str(headers["subject"])
+        )
+    ):
+        return None
+
+    # Bail on shit messages
+    if not headers.get("to", "") or not headers.get("from", ""):
+        return None
+
+    # Already imported, maybe from another archive.
+    msg_key = message_key(headers)
+    if seen_messages.skip_if_seen(msg_key):
+        return None
+
+    sender, receiver = parse_people2(message=headers, address_cache=address_cache)
+    sender_name, sender_addr = sender[0]
 
-    return(True)
+    receiver_name, receiver_addr = receiver[0]
+
+    # # I don't think emails to me an many others give insight into me...?
+    if (
+        len(receiver) > 1 or "Junk" in receiver_name
+    ) and sender_addr.lower() not in config.emails_dict:
+        return None
+
+    # I don't think emails to me an many others give insight into me...?
+    if "Junk" in sender_name and receiver_addr.lower() not in config.emails_dict:
+        return None
+
+    return msg_key, sender, receiver
+
+
+def process_message(raw_message: bytes) -> Optional[dict]:
+    """
+    Filters and cleans a single message. Doesn't touch the DB, so it can run in a worker.
+
+    Args:
+        raw_message (bytes): The message as it is in the mbox, "From " line included.
+
+    Returns:
+        dict: The row to write and the people in it, or None if the message is skipped.
+    """
+    # Bail out before parsing the body.
+    triage = triage_message(message_from_bytes(header_block(raw_message)))
+    if triage is None:
+        return None
+    msg_key, sender, receiver = triage
+
+    record = extract_text_from_message(original_message=message_from_bytes(raw_message))
+    record.sender = sender[0]
+    record.receiver = receiver[0]
+
+    # The text parts are already ascii, so straight on to the HTML.
+    html_start = time.perf_counter()
+    clean_payload, html_path = strip_html(message_payload=record.body)
+    html_seconds = time.perf_counter() - html_start
+    # This is some janky smashing to ascii. I'm too annoyed with email to investigate.
+    record.body = clean_payload.encode("ascii", "ignore").decode("ascii")
+
+    record = clean_up_msg(message=record)
+
+    sender_name, sender_addr = record.sender
+    receiver_name, receiver_addr = record.receiver
+    return {
+        "msg_key": msg_key,
+        "from_header": record.from_line,
+        "msg_date": record.date,
+        "sender_addr": sender_addr,
+        "sender_name": sender_name,
+        "receiver_addr": receiver_addr,
+        "receiver_name": receiver_name,
+        "subject": record.subject,
+        "headers": record.headers,
+        "payload": record.body,
+        "html_path": html_path,
+        "html_seconds": html_seconds,
+    }
+
+
+def init_worker(input_files: List[str], validated: dict):
+    """Pool initializer. Each worker maps the mbox files itself so only offsets cross the pipe."""
+    global worker_files, worker_readers, address_cache, seen_messages
+    worker_files = input_files
+    # Opened on first use, a worker may never see some of the files.
+    worker_readers = {}
+    address_cache = AddressCache(validated=validated)
+    seen_messages = SeenMessages(
+        sqlite3.connect(f"file:{config.sqlite_email_file}?mode=ro", uri=True)
+    )
+
+
+def process_raw_message(task: Tuple[int, int, int]) -> Tuple[int, str, int, Optional[dict], dict]:
+    """
+    Worker entry point for --workers. Parses and cleans one message.
+
+    Args:
+        task (tuple): (file number, start, stop) of the message in the input files.
+
+    Returns:
+        tuple: The file number, the message's from line and size, the result
+        of process_message and the worker's counters since the last message.
+    """
+    file_number, start, stop = task
+    if file_number not in worker_readers:
+        worker_readers[file_number] = MboxReader(worker_files[file_number], use_index=False)
+    raw_message = worker_readers[file_number].get_range(start, stop)
+    try:
+        result = process_message(raw_message)
+        stats = {
+            "address_cache": address_cache.drain(),
+            "duplicates": seen_messages.drain(),
+        }
+        return file_number, from_line(raw_message), len(raw_message), result, stats
+    except SystemExit as e:
+        # A sys.exit() in a pool worker kills it and hangs the pool, so hand it to the parent.
+        raise RuntimeError(
+            f"Stopped on message {from_line(raw_message)}"
+        ) from e
+
+
+def serial_results(imports: List[MboxImport]):
+    """The same as the pool's results, processed here one at a time."""
+    for file_number, mbox_import in enumerate(imports):
+        for start, stop in mbox_import.offsets():
+            raw_message = mbox_import.reader.get_range(start, stop)
+            yield file_number, from_line(raw_message), len(raw_message), process_message(raw_message), None
+
+
+def store_message(
+    result: dict,
+    recipients_list: dict,
+    address_book: dict,
+    html_timings: dict,
+    writer: MsgWriter,
+) -> Tuple[dict, dict]:
+    """Queues a processed message for the DB and updates the recipient and address lists. Main process only."""
+    # Workers only see keys that are committed, so duplicates within a batch end up here.
+    if seen_messages.skip_if_seen(result["msg_key"]):
+        return recipients_list, address_book
+    seen_messages.keys.add(result["msg_key"])
+    writer.add_msg_key(msg_key=result["msg_key"], from_header=result["from_header"])
+
+    count, seconds = html_timings.get(result["html_path"], (0, 0.0))
+    html_timings[result["html_path"]] = (count + 1, seconds + result["html_seconds"])
+
+    # Write all messages to the raw_msgs table for later recipient parsing.
+    writer.add(
+        from_header=result["from_header"],
+        msg_date=result["msg_date"],
+        sender=result["sender_addr"],
+        receiver=result["receiver_addr"],
+        subject=result["subject"],
+        headers=result["headers"],
+        payload=result["payload"],
+        table_name=DB_NAME2,
+    )
+
+    sender_addr = result["sender_addr"]
+    if sender_addr.lower() in config.emails_dict:
+        if config.emails_dict[sender_addr.lower()] == config.your_name:
+            writer.add(
+                from_header=result["from_header"],
+                msg_date=result["msg_date"],
+                sender=sender_addr,
+                receiver=result["receiver_addr"],
+                subject=result["subject"],
+                headers=result["headers"],
+                payload=result["payload"],
+                table_name=DB_NAME1,
+            )
+        # Add the email to the list of people I've sent mail to
+        recipients_list = add_recipient(
+            receiver_addr=result["receiver_addr"],
+            receiver_name=result["receiver_name"],
+            recipients_list=recipients_list,
+        )
+        # Some hacky stuff because I'm to tired to properly figure out the second pass sender info
+        address_book = add_address(email_addr=sender_addr,
+                                   display_name=result["sender_name"],
+                                   address_book=address_book)
+        address_book = add_address(email_addr=result["receiver_addr"],
+                                   display_name=result["receiver_name"],
+                                   address_book=address_book)
+    return recipients_list, address_book
 
 
 if __name__ == "__main__":
-    DB_NAME1 = "msgs"
-    DB_NAME2 = "raw_msgs"
     arg_parser = argparse.ArgumentParser(
         description="Loads a mbox file into a sqlite DB"
     )
-    arg_parser.add_argument("input_file", help="Specify the file to be processed")
+    arg_parser.add_argument(
+        "input_files",
+        nargs="+",
+        help="mbox files, directories of .mbox files or glob patterns to import",
+    )
+    arg_parser.add_argument(
+        "--workers",
+        "-w",
+        type=int,
+        default=1,
+        help="Number of processes used to parse and clean messages. Default is 1 (no pool).",
+    )
+    arg_parser.add_argument(
+        "--no-index",
+        action="store_true",
+        help="Don't read or write the <mbox file>.idx message offset index.",
+    )
+    arg_parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Re-import the whole file, even the part an earlier run already imported.",
+    )
+    arg_parser.add_argument(
+        "--persist-address-cache",
+        action="store_true",
+        help="Load and save email address validation results in the DB, so re-imports skip validation.",
+    )
+    arg_parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=500,
+        help="Messages written per transaction. Default is 500.",
+    )
     args = arg_parser.parse_args()
 
     console = Console()
     console.clear()
-    # If the file doesn't exist stop.
-    if not args.input_file or not os.path.isfile(args.input_file):
-        console.print("Missing argument")
+    # If there are no files stop.
+    input_files = expand_inputs(args.input_files)
+    if not input_files:
+        console.print("No mbox files found")
         console.print(arg_parser.format_help())
         sys.exit(errno.EINVAL)
 
-    mbox = mailbox.mbox(args.input_file)
-    console.print("Opening mbox {}.".format(args.input_file))
+    console.print("Opening {} mbox files: {}.".format(len(input_files), ", ".join(input_files)))
 
     if not os.path.isfile(config.sqlite_email_file):
         create_tables()
 
-    connection = sqlite3.connect(config.sqlite_email_file)
+    connection = connect(config.sqlite_email_file)
     if not table_exists(connection=connection, table_name=DB_NAME1):
         create_tables()
-
-    recipients_list = {}
+    add_sender_norm(connection=connection)
+    create_msg_ids_table(connection=connection)
+    seen_messages.connection = connection
+
+    # Mail sent in earlier runs counts too, otherwise an incremental run
+    # wouldn't promote new mail from people you wrote to before.
+    recipients_list = load_recipients(connection=connection)
+    address_book = {}
+    html_timings = {}
+
+    writer = MsgWriter(
+        connection=connection, batch_size=args.batch_size, codec=payload_codec()
+    )
+    if args.persist_address_cache:
+        address_cache.load(connection=connection)
 
     # First pass to remove attachments
-    for count, original_message in enumerate(mbox):
-        console.print(
-            "Processing message {} - {}.".format(
-                count, remove_non_ascii(original_message.get_from().replace("\r", ""))
-            )
+    imports = [
+        MboxImport(
+            mbox_file=mbox_file,
+            connection=connection,
+            use_index=not args.no_index,
+            full=args.full,
         )
-
-        # Bail out before parsing anything.
-        # Add your exceptions here, for problematic messages...
-        if "X-Gmail-Labels" in original_message and (
-            "Chat" in original_message["X-Gmail-Labels"]
-            or "Spam" in original_message["X-Gmail-Labels"]
-            or (
-                original_message["subject"] is not None
-                and "SQL dump -" in str(original_message["subject"])
+        for mbox_file in input_files
+    ]
+    for mbox_import in imports:
+        if mbox_import.start_offset:
+            console.print(
+                f"{mbox_import.mbox_file}: skipping {mbox_import.start_offset} bytes "
+                f"({mbox_import.manifest[3]} messages) imported by an earlier run."
             )
-        ):
-            continue
-
-        # Bail on shit messages
-        if not original_message.get("to", "") or not original_message.get("from", ""):
-            continue
-
-        sender, receiver = parse_people2(message=original_message)
-        sender_name, sender_addr = sender[0]
 
-        receiver_name, receiver_addr = receiver[0]
-
-        # # I don't think emails to me an many others give insight into me...?
-        if (
-            len(receiver) > 1 or "Junk" in receiver_name
-        ) and sender_addr.lower() not in config.emails_dict:
-            continue
-
-        # I don't think emails to me an many others give insight into me...?
-        if "Junk" in sender_name and receiver_addr.lower() not in config.emails_dict:
-            continue
-
-
-
-        new_message = extract_text_from_message(original_message=original_message)
-
-        # Decode the message to ascii
-        if isinstance(new_message.get_payload(), list):
-            for item in new_message.get_payload():
-                if item["Content-Type"].startswith(("text/html", "text/plain")):
-                    if "base64" in item["Content-Transfer-Encoding"]:
-                        decoded_bytes = base64.b64decode(item.get_payload())
-                        new_message.set_payload(payload=decoded_bytes)
-                    else:
-                        new_message.set_payload(payload=item.get_payload())
-
-        clean_payload = remove_non_ascii(new_message.get_payload())
-        clean_payload = strip_html(message_payload=clean_payload)
-        # This is some janky smashing to ascii. I'm too annoyed with email to investigate.
-        new_message.set_payload(payload=clean_payload.encode("ascii", "ignore"))
-
-        # This loops until there are no more "hits" on sigs/replies
-        flag = True
-        while flag:
-            new_message, flag = clean_up_msg(message=new_message)
-
-        # Write all messages to the raw_msgs table for later recipient parsing.
-        write_msg_to_db(
-            from_header=original_message.get_from(),
-            msg_date=parse_date_from_from_header(original_message.get_from()),
-            sender=sender_addr,
-            receiver=receiver_addr,
-            subject=new_message["subject"],
-            headers=parse_headers(new_message._headers),
-            payload=new_message.get_payload(),
-            table_name=DB_NAME2,
-            connection=connection,
+    pool = None
+    if args.workers > 1:
+        # Workers only parse and clean, from all the files at once so there is
+        # no stall between them. Everything comes back here in input order, so
+        # there is a single writer and the DB ends up the same as a serial run.
+        pool = multiprocessing.Pool(
+            processes=args.workers,
+            initializer=init_worker,
+            initargs=(input_files, address_cache.validated),
+        )
+        tasks = (
+            (file_number, start, stop)
+            for file_number, mbox_import in enumerate(imports)
+            for start, stop in mbox_import.offsets()
         )
+        results = pool.imap(process_raw_message, tasks, chunksize=WORKER_CHUNKSIZE)
+    else:
+        results = serial_results(imports)
 
-        if sender_addr.lower() in config.emails_dict:
-            if config.emails_dict[sender_addr.lower()] == config.your_name:
-                write_msg_to_db(
-                    from_header=original_message.get_from(),
-                    msg_date=parse_date_from_from_header(original_message.get_from()),
-                    sender=sender_addr,
-                    receiver=receiver_addr,
-                    subject=new_message["subject"],
-                    headers=parse_headers(new_message._headers),
-                    payload=new_message.get_payload(),
-                    table_name=DB_NAME1,
-                    connection=connection,
+    last_time = time.perf_counter()
+    current_file = 0
+    promoted = 0
+    try:
+        for count, (file_number, from_header, size, result, stats) in enumerate(results):
+            if file_number != current_file:
+                # Promote after each file, so msgs gets the same ids as a run per file.
+                writer.flush()
+                promoted += promote_recipients(recipients_list=recipients_list, connection=connection)
+                current_file = file_number
+            mbox_import = imports[file_number]
+            if stats is not None:
+                address_cache.merge(stats["address_cache"])
+                seen_messages.duplicates += stats["duplicates"]
+            console.print(
+                "Processing message {} - {}.".format(
+                    count, remove_non_ascii(from_header.replace("\r", ""))
                 )
-            # Add the email to the list of people I've sent mail to
-            recipients_list = add_recipient(
-                receiver_addr=receiver_addr,
-                receiver_name=receiver_name,
-                recipients_list=recipients_list,
             )
-            # Some hacky stuff because I'm to tired to properly figure out the second pass sender info
-            add_address(email_addr=sender_addr,
-                        display_name=sender_name,
-                        table_name="address_book",
-                        connection=connection)
-            add_address(email_addr=receiver_addr,
-                        display_name=receiver_name,
-                        table_name="address_book",
-                        connection=connection)
+            mbox_import.bytes += size
+            if result is None:
+                mbox_import.skipped += 1
+                mbox_import.skipped_bytes += size
+            else:
+                duplicates = seen_messages.duplicates
+                recipients_list, address_book = store_message(
+                    result=result,
+                    recipients_list=recipients_list,
+                    address_book=address_book,
+                    html_timings=html_timings,
+                    writer=writer,
+                )
+                if seen_messages.duplicates == duplicates:
+                    mbox_import.stored += 1
+                else:
+                    mbox_import.skipped += 1
+            now = time.perf_counter()
+            mbox_import.seconds += now - last_time
+            last_time = now
+    except RuntimeError as e:
+        console.print(e)
+        sys.exit(1)
+    finally:
+        if pool is not None:
+            pool.terminate()
+    # The second pass reads raw_msgs, so everything has to be in the DB first.
+    writer.flush()
+
     # Second pass
     # Ensures that only people the recipients_list are added to the DB_NAME1 db
-    for recipient, value in recipients_list.items():
-        sql = f"SELECT * FROM {DB_NAME2} WHERE sender LIKE '%{recipient}%'"
-        cursor = connection.cursor()
-        console.print(f"Checking messages from {recipient}")
-        for msg in cursor.execute(sql):
-            # skip msg[0] as it's 'id' col
-            write_msg_to_db(
-                from_header=msg[1],
-                msg_date=msg[2],
-                sender=msg[3],
-                receiver=msg[4],
-                subject=msg[5],
-                headers=msg[6],
-                payload=msg[7],
-                table_name=DB_NAME1,
-                connection=connection,
-            )
+    console.print(f"Checking messages from {len(recipients_list)} recipients")
+    promoted += promote_recipients(recipients_list=recipients_list, connection=connection)
+    console.print(f"{promoted} messages from recipients added to {DB_NAME1}")
+
+    changed = write_address_book(
+        address_book=address_book, table_name="address_book", connection=connection
+    )
+    console.print(f"address_book: {len(address_book)} addresses, {changed} inserted or updated")
 
+    for line in writer.report():
+        console.print(line)
+
+    # Only after everything is committed, so a crashed run is simply redone.
+    for mbox_import in imports:
+        mbox_import.save_manifest(connection=connection)
+        mbox_import.reader.close()
+
+    for mbox_import in imports:
+        console.print(mbox_import.summary())
+    console.print(
+        "Skipped {:.1f}MB of messages on their headers alone".format(
+            sum(mbox_import.skipped_bytes for mbox_import in imports) / 1048576
+        )
+    )
+    console.print(f"Skipped {seen_messages.duplicates} messages already imported (Message-ID)")
+    for line in address_cache.report():
+        console.print(line)
+    if args.persist_address_cache:
+        saved = address_cache.save(connection=connection)
+        console.print(f"Saved {saved} address validations")
+
+    for html_path, (count, seconds) in html_timings.items():
+        console.print(
+            f"HTML {html_path}: {count} messages, {seconds:.3f}s, {seconds / count * 1000000:.0f}us per message"
+        )
@@ -2,37 +2,46 @@
 """
 What it does:
 
-This script is designed to process a mail file (.mbox) and extract facts
-about individuals mentioned in the messages. It uses a large language model (LLM)
-to generate facts based on the context of each message.
+This script extracts facts about you from the emails in the SQLite email DB
+(config.sqlite_email_file, filled by 1.0). It sends each msgs row that has no
+facts yet to the LLM (llm_facts_model) and stores the JSON answer in
+email_facts, keyed by a hash of the message's From line. A re-run only does
+the messages that are still missing, so it can be stopped and started again.
 
-The script takes a mail file as input, processes each email, and generates a
-set of facts about the sender and receiver using the LLM. The facts are then
-written to a JSON file for storage.
+Requests run in threads, answers go through the LLM cache (llm_cache.py) and
+each call's timings are recorded for llm_metrics.py.
 
 Inputs:
 
-- A mail file (.mbox) containing email messages
-- An optional command-line argument `--takeout` or `-t` to indicate that the
-  input file is a Takeout file
+    --concurrency, -c N  LLM requests in flight at once. Default llm_facts_concurrency, or 1.
+    --timeout S          Seconds before an LLM request is retried. Default llm_timeout, or 300.
+    --retries N          Retries before a message is left for the next run. Default llm_retries, or 2.
+    --max-tokens N       Split email bodies over N tokens into several requests.
+                         Default llm_facts_max_tokens, 0 is off.
+    --max-chunks N       Requests per email at most, the rest is dropped. Default 4.
+    --batch-tokens N     Pack short emails into one request of up to N body tokens.
+                         Default llm_facts_batch_tokens, 0 is off.
+    --batch-size N       Emails per packed request at most. Default 8.
+    --queue, -q          Take work from the shared fact_jobs queue (fact_queue.py),
+                         so several 1.1 processes can run at once.
+    --llm-url URL        Ollama to send this process's requests to. Default llm_url.
+    --debug, -d          LangChain debug output.
 
 Outputs:
 
-- A set of JSON files containing facts about individuals mentioned in the emails,
- stored in the directory specified by the `email_facts_dir` configuration variable.
-Each JSON file contains a single fact about an individual, and the filename is based
-on the SHA-256 hash of the sender's email address.
+    The email_facts table, and the fact_jobs table with --queue.
 """
 
 import argparse
 import errno
-import hashlib
 import sqlite3
 import os
 import sys
 import datetime
 import json
 import time
+from itertools import chain
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
 
 from dateutil import parser
 
@@ -40,28 +49,101 @@ from rich import print
 from rich.console import Console
 from rich.style import Style
 
-from langchain_ollama import ChatOllama
 from langchain_core.messages import HumanMessage
 
 import config
-from utilities import remove_non_ascii, remove_blank_lines, clean_facts, table_exists
+from email_store import PENDING_FACTS_SQL, connect, fact_hash, read_rows
+from fact_queue import BUSY_TIMEOUT, QUEUE_TABLE, FactQueue
+from llm_cache import enable_llm_cache, was_cached
+from llm_metrics import enable_llm_metrics, record_llm_call
+from utilities import (
+    remove_non_ascii,
+    remove_blank_lines,
+    clean_facts,
+    get_chat_model,
+    table_exists,
+    retry_call,
+    run_bounded,
+    estimate_tokens,
+    split_to_token_budget,
+    merge_json_objects,
+)
+
+# Ollama serves OLLAMA_NUM_PARALLEL requests at once, match it with --concurrency.
+LLM_FACTS_CONCURRENCY = getattr(config, "llm_facts_concurrency", 1)
+# Seconds before a single LLM request is given up on, and how often it's retried.
+LLM_TIMEOUT = getattr(config, "llm_timeout", 300)
+LLM_RETRIES = getattr(config, "llm_retries", 2)
+# Email bodies over llm_facts_max_tokens are split into that many token chunks,
+# each sent on its own and the facts merged. Past llm_facts_max_chunks the rest
+# of the body is dropped. 0 sends every body whole, as before.
+LLM_FACTS_MAX_TOKENS = getattr(config, "llm_facts_max_tokens", 0)
+LLM_FACTS_MAX_CHUNKS = getattr(config, "llm_facts_max_chunks", 4)
+# Short emails are packed into one request, up to llm_facts_batch_size emails
+# and llm_facts_batch_tokens tokens of body. 0 sends every email on its own.
+LLM_FACTS_BATCH_TOKENS = getattr(config, "llm_facts_batch_tokens", 0)
+LLM_FACTS_BATCH_SIZE = getattr(config, "llm_facts_batch_size", 8)
+
+
+def pending_messages(connection: sqlite3.Connection) -> Tuple[int, Iterator]:
+    """
+    The messages still needing facts, newest first, streamed off a cursor so
+    only the rows in flight are held in memory. Messages that already have
+    facts never leave SQLite, so resuming after a crash starts right away.
+
+    Returns:
+        tuple: How many messages are pending and an iterator of their MsgRows.
+    """
+    # Lets ORDER BY walk the index instead of sorting every pending payload.
+    connection.execute("CREATE INDEX IF NOT EXISTS index_msg_date ON msgs (msg_date)")
+    pending = connection.execute(f"SELECT count(*) {PENDING_FACTS_SQL}").fetchone()[0]
+    # Facts are written on this connection while the cursor is still being read.
+    # They're only ever for rows it has already returned, so that's safe.
+    cursor = connection.execute(f"SELECT m.* {PENDING_FACTS_SQL} ORDER BY m.msg_date DESC")
+    return pending, read_rows(cursor)
 
 
 def create_tables():
-    connection = sqlite3.connect(config.sqlite_email_file)
+    # IF NOT EXISTS, several --queue workers may start on a new DB at once.
+    connection = sqlite3.connect(config.sqlite_email_file, timeout=BUSY_TIMEOUT)
     cursor = connection.cursor()
-    sql = "CREATE TABLE email_facts (fact_hash TEXT UNIQUE, fact_date TIMESTAMP, msg_from TIMESTAMP, facts TEXT)"
+    sql = "CREATE TABLE IF NOT EXISTS email_facts (fact_hash TEXT UNIQUE, fact_date TIMESTAMP, msg_from TIMESTAMP, facts TEXT)"
     cursor.execute(sql)
-    sql = "CREATE INDEX index_fact_hash ON email_facts (fact_hash);"
+    sql = "CREATE INDEX IF NOT EXISTS index_fact_hash ON email_facts (fact_hash);"
     cursor.execute(sql)
     connection.close()
 
 
+def information_types() -> str:
+    """The fact types and what they mean, shared by the single and batch prompts."""
+    return f"""*Specific Instructions for Information Types:*
+
+* **Thought:** A specific thought or belief expressed or implied by {config.your_name}.
+* **Feeling:** An emotion expressed or implied by {config.your_name}.
+* **Motivation:** A reason or driving force behind {config.your_name}'s actions or decisions.
+* **Characteristic:** A quality or trait of {config.your_name}'s personality or behavior.
+* **Value:** A principle or belief that is important to {config.your_name}.
+* **Learning:** Something {config.your_name} has learned or is trying to learn.
+* **AreaForImprovement:** An area where {config.your_name} identifies a need for personal or professional development.
+* **Hobby:** An activity {config.your_name} enjoys doing regularly for leisure. Example: "Enjoys playing guitar."
+* **Interest:** Something that {config.your_name} finds intellectually stimulating or engaging. Example: "Interested in learning about artificial intelligence."
+* **Preference:** Something that {config.your_name} likes or dislikes. Example: "Prefers coffee over tea."
+* **PersonalDetail:**  A factual piece of information about {config.your_name}, such as "Lives in London", "Is a member of the local hiking club", "loves dogs", "is a vegetarian".  Be cautious about extracting extremely sensitive information unless it is explicitly stated.
+
+"""
+
+
 def do_facts(
-    message: str, msg_date: datetime, subject: str, sender: str, receiver: str
+    message: str,
+    msg_date: datetime,
+    subject: str,
+    sender: str,
+    receiver: str,
+    timeout: float = LLM_TIMEOUT,
+    base_url: str = None,
 ) -> str:
-    llm = ChatOllama(
-        model=config.llm_facts_model, base_url=config.llm_url, keep_alive=-1
+    llm = get_chat_model(
+        config.llm_facts_model, base_url=base_url, timeout=timeout, keep_alive=-1
     )
 
     prompt = [
@@ -77,21 +159,7 @@ For each insight or fact, *always include the source*. This can be the sender, r
 
 Include the message date in every finding.
 
-*Specific Instructions for Information Types:*
-
-* **Thought:** A specific thought or belief expressed or implied by {config.your_name}.
-* **Feeling:** An emotion expressed or implied by {config.your_name}.
-* **Motivation:** A reason or driving force behind {config.your_name}'s actions or decisions.
-* **Characteristic:** A quality or trait of {config.your_name}'s personality or behavior.
-* **Value:** A principle or belief that is important to {config.your_name}.
-* **Learning:** Something {config.your_name} has learned or is trying to learn.
-* **AreaForImprovement:** An area where {config.your_name} identifies a need for personal or professional development.
-* **Hobby:** An activity {config.your_name} enjoys doing regularly for leisure. Example: "Enjoys playing guitar."
-* **Interest:** Something that {config.your_name} finds intellectually stimulating or engaging. Example: "Interested in learning about artificial intelligence."
-* **Preference:** Something that {config.your_name} likes or dislikes. Example: "Prefers coffee over tea."
-* **PersonalDetail:**  A factual piece of information about {config.your_name}, such as "Lives in London", "Is a member of the local hiking club", "loves dogs", "is a vegetarian".  Be cautious about extracting extremely sensitive information unless it is explicitly stated.
-
-Focus on inferring these internal aspects and extracting factual details from the email's content.  If the email only describes external events without revealing anything about {config.your_name}'s internal state or factual details, return an empty JSON object.
+{information_types()}Focus on inferring these internal aspects and extracting factual details from the email's content.  If the email only describes external events without revealing anything about {config.your_name}'s internal state or factual details, return an empty JSON object.
 
 Email:
 
@@ -105,10 +173,238 @@ Body:
         )
     ]
 
+    started = time.time()
     data = llm.invoke(prompt)
+    record_llm_call(
+        "facts",
+        config.llm_facts_model,
+        base_url or config.llm_url,
+        started,
+        time.time() - started,
+        metadata=data.response_metadata,
+        cached=was_cached(data),
+    )
     return data.content
 
 
+def do_facts_batch(
+    emails: List[dict],
+    timeout: float = LLM_TIMEOUT,
+    base_url: str = None,
+) -> str:
+    """
+    Like do_facts for several emails in one request, so the instructions are
+    only evaluated once. Each email is a dict with id and do_facts' arguments.
+    The answer should be a JSON object keyed by the email ids.
+    """
+    llm = get_chat_model(
+        config.llm_facts_model, base_url=base_url, timeout=timeout, keep_alive=-1
+    )
+
+    emails_text = "".join(
+        f"""=== Email {email["id"]} ===
+Sender: {email["sender"]}
+Recipient: {email["receiver"]}
+Date: {email["msg_date"]}
+Subject: {email["subject"]}
+Body: 
+{email["message"]}
+=== End of email {email["id"]} ===
+
+"""
+        for email in emails
+    )
+    prompt = [
+        HumanMessage(
+            content=f"""
+You are an AI that extracts information from emails to understand *{config.your_name}* better.  Focus on what each email reveals about {config.your_name}'s thoughts, feelings, motivations, characteristics, *and factual information about their interests, hobbies, preferences, and personal details*.
+
+We know that {config.your_name} uses the following emails {config.emails_dict}.  These email addresses are known facts and do not need to be restated. Use these to help determine if a mentioned email address refers to {config.your_name} or someone else.
+
+Analyze each of the following emails on its own and extract information that helps understand {config.your_name}.  Each email starts with a line "=== Email <id> ===" and ends with "=== End of email <id> ===".  Return a single JSON object with one key for every email id.  The value for each id is a JSON object where each piece of information from that email is categorized under a type (e.g., "Thought", "Feeling", "Motivation", "Characteristic", "Value", "Learning", "AreaForImprovement", "Hobby", "Interest", "Preference", "PersonalDetail").  If no relevant insights or facts about {config.your_name} are found in an email, its value is an empty JSON object `{{}}`.
+
+For each insight or fact, *always include the source*. This can be the sender, recipient, subject, or a specific part of the email body.  Use a "source" key in the JSON object alongside the "type" and the information itself (e.g., "insight" or "fact").
+
+Include the message date in every finding.
+
+{information_types()}Focus on inferring these internal aspects and extracting factual details from each email's content.  Never mix up facts from different emails.
+
+Emails:
+
+{emails_text}    """
+        )
+    ]
+
+    started = time.time()
+    data = llm.invoke(prompt)
+    record_llm_call(
+        "facts",
+        config.llm_facts_model,
+        base_url or config.llm_url,
+        started,
+        time.time() - started,
+        metadata=data.response_metadata,
+        cached=was_cached(data),
+        items=len(emails),
+    )
+    return data.content
+
+
+def parse_facts_json(facts: str) -> dict:
+    """The JSON object in an LLM answer. Raises ValueError if there isn't one."""
+    start = facts.index("{")
+    end = facts.rindex("}") + 1
+    return json.loads(facts[start:end])
+
+
+def extract_facts(
+    job: dict, timeout: float, retries: int, base_url: str = None
+) -> Tuple[dict, Optional[str], float]:
+    """
+    Runs do_facts for one message, once per chunk of a long body, retrying
+    failed or timed out requests. Safe to call from several threads at once.
+    base_url picks the Ollama, config.llm_url by default.
+
+    Returns:
+        tuple: The job, the LLM output (None if every try failed) and seconds spent.
+    """
+    start_time = time.perf_counter()
+    chunks = job["chunks"]
+    outputs = []
+    try:
+        for number, chunk in enumerate(chunks, start=1):
+            prompt = dict(job["prompt"], message=chunk)
+            if len(chunks) > 1:
+                prompt["subject"] = f"{prompt['subject']} (part {number} of {len(chunks)})"
+            outputs.append(
+                retry_call(do_facts, retries=retries, timeout=timeout, base_url=base_url, **prompt)
+            )
+    except Exception as e:
+        print(f"Giving up on {job['fact_hash']}: {e}")
+        return job, None, round(time.perf_counter() - start_time, 3)
+
+    if len(outputs) == 1:
+        facts = outputs[0]
+    else:
+        found = []
+        for output in outputs:
+            try:
+                found.append(parse_facts_json(output))
+            except ValueError:
+                print(f"No JSON in one part of {job['fact_hash']}, skipping it.")
+        facts = json.dumps(merge_json_objects(found))
+    return job, facts, round(time.perf_counter() - start_time, 3)
+
+
+def extract_batch(
+    batch: List[dict], timeout: float, retries: int, base_url: str = None
+) -> List[Tuple[dict, Optional[str], float]]:
+    """
+    Runs a batch from batch_jobs() as one do_facts_batch request and splits
+    the answer back into a result per job, like extract_facts returns. Jobs
+    the answer has nothing for, or all of them if it isn't JSON keyed by the
+    email ids, are sent again one at a time.
+    """
+    if len(batch) == 1:
+        return [extract_facts(batch[0], timeout=timeout, retries=retries, base_url=base_url)]
+
+    start_time = time.perf_counter()
+    emails = [dict(job["prompt"], id=job["msg_id"], message=job["chunks"][0]) for job in batch]
+    try:
+        found = parse_facts_json(
+            retry_call(do_facts_batch, emails, retries=retries, timeout=timeout, base_url=base_url)
+        )
+    except Exception as e:
+        print(f"Batch of {len(batch)} failed, sending them one at a time: {e}")
+        found = {}
+    elapsed_time = round((time.perf_counter() - start_time) / len(batch), 3)
+
+    results = []
+    leftovers = []
+    for job in batch:
+        facts = found.get(str(job["msg_id"])) if isinstance(found, dict) else None
+        if isinstance(facts, dict):
+            job["batched"] = True
+            results.append((job, json.dumps(facts), elapsed_time))
+        else:
+            leftovers.append(job)
+    if leftovers and len(leftovers) < len(batch):
+        print(f"{len(leftovers)} of {len(batch)} emails missing from the batch answer, sending them one at a time.")
+    for job in leftovers:
+        job["batch_fallback"] = True
+        results.append(extract_facts(job, timeout=timeout, retries=retries, base_url=base_url))
+    return results
+
+
+def pending_jobs(
+    messages: Iterable,
+    console: Console,
+    max_tokens: int = LLM_FACTS_MAX_TOKENS,
+    max_chunks: int = LLM_FACTS_MAX_CHUNKS,
+    on_skip: Callable = None,
+):
+    """
+    Yields a job for each message with a body, from pending_messages() or
+    FactQueue.messages(). Bodies over max_tokens are split into chunks, see
+    split_to_token_budget(). on_skip is called with the id of each message
+    that has no body.
+    """
+    for count, message in enumerate(messages):
+        msg_date_flat = remove_non_ascii(message[1].replace('\\r', ''))
+        console.print(
+            f"Processing message {count} - {msg_date_flat}",
+            style=info_style,
+        )
+        from_hash = fact_hash(message[1])
+        payload = remove_blank_lines(message[7])
+        # Square brackets cause problems with rich printing
+        payload = payload.replace("[", "(").replace("]", ")")
+        if payload.isspace():
+            console.print("There is no message in the email.", style=error_style)
+            if on_skip is not None:
+                on_skip(message[0])
+            continue
+        chunks, tokens_dropped = split_to_token_budget(payload, max_tokens, max_chunks)
+        yield {
+            "fact_hash": from_hash,
+            "fact_date": message[1],
+            "msg_from": message[0],
+            "msg_id": message[0],
+            "chunks": chunks,
+            "tokens": estimate_tokens(payload),
+            "tokens_dropped": tokens_dropped,
+            "prompt": {
+                "msg_date": parser.parse(message[2]),
+                "subject": message[5],
+                "sender": message[3],
+                "receiver": message[4],
+            },
+        }
+
+
+
+def batch_jobs(jobs: Iterable, max_tokens: int, max_size: int) -> Iterator[List[dict]]:
+    """
+    Groups jobs from pending_jobs() for extract_batch(). Short emails are packed
+    together up to max_size emails and max_tokens tokens of body, anything
+    longer (or split into chunks) goes on its own. max_tokens 0 puts every job
+    on its own.
+    """
+    batch = []
+    batch_tokens = 0
+    for job in jobs:
+        if max_tokens <= 0 or len(job["chunks"]) > 1 or job["tokens"] > max_tokens:
+            yield [job]
+            continue
+        if batch and (batch_tokens + job["tokens"] > max_tokens or len(batch) >= max_size):
+            yield batch
+            batch = []
+            batch_tokens = 0
+        batch.append(job)
+        batch_tokens += job["tokens"]
+    if batch:
+        yield batch
+
 
 def write_msg_to_db(
     fact_hash: str,
@@ -142,7 +438,63 @@ if __name__ == "__main__":
     argparser.add_argument(
         "--verbose", "-v", help="Increase Verbosity of output", action="store_true"
     )
+    argparser.add_argument(
+        "--concurrency",
+        "-c",
+        type=int,
+        default=LLM_FACTS_CONCURRENCY,
+        help="LLM requests in flight at once. Default is llm_facts_concurrency, or 1.",
+    )
+    argparser.add_argument(
+        "--timeout",
+        type=float,
+        default=LLM_TIMEOUT,
+        help="Seconds before an LLM request is retried.",
+    )
+    argparser.add_argument(
+        "--retries",
+        type=int,
+        default=LLM_RETRIES,
+        help="Times a failed LLM request is retried before the message is left for the next run.",
+    )
+    argparser.add_argument(
+        "--max-tokens",
+        type=int,
+        default=LLM_FACTS_MAX_TOKENS,
+        help="Estimated tokens of email body per LLM request. Longer bodies are split. 0 (default) is off.",
+    )
+    argparser.add_argument(
+        "--max-chunks",
+        type=int,
+        default=LLM_FACTS_MAX_CHUNKS,
+        help="Requests per email at most. The rest of a longer body is dropped. 1 just truncates.",
+    )
+    argparser.add_argument(
+        "--batch-tokens",
+        type=int,
+        default=LLM_FACTS_BATCH_TOKENS,
+        help="Pack short emails into one request up to this many body tokens. 0 (default) is off.",
+    )
+    argparser.add_argument(
+        "--batch-size",
+        type=int,
+        default=LLM_FACTS_BATCH_SIZE,
+        help="Emails per packed request at most.",
+    )
+    argparser.add_argument(
+        "--queue",
+        "-q",
+        action="store_true",
+        help="Take work from the shared fact_jobs queue, so several 1.1 processes can run at once.",
+    )
+    argparser.add_argument(
+        "--llm-url",
+        default=config.llm_url,
+        help="Ollama to send this process's requests to. Default is llm_url.",
+    )
     args = argparser.parse_args()
+    llm_cache = enable_llm_cache()
+    enable_llm_metrics()
 
     # If the file doesn't exist stop.
     if not os.path.isfile(config.sqlite_email_file):
@@ -161,7 +513,8 @@ if __name__ == "__main__":
 
     documents = []
 
-    connection = sqlite3.connect(config.sqlite_email_file)
+    # Other --queue workers may be writing, wait for them rather than fail.
+    connection = connect(config.sqlite_email_file, timeout=BUSY_TIMEOUT)
     if not table_exists(connection=connection, table_name="email_facts"):
         create_tables()
 
@@ -170,55 +523,70 @@ if __name__ == "__main__":
 
         langchain.debug = True
 
-    sql = "SELECT * FROM msgs ORDER BY msg_date DESC;"
-    cursor = connection.cursor()
-
-    cursor.execute(sql)
-    messages = cursor.fetchall()
-    print(len(messages))
-    for count, message in enumerate(messages):
-        msg_date_flat = remove_non_ascii(message[1].replace('\\r', ''))
+    queue = None
+    if args.queue:
+        queue = FactQueue(config.sqlite_email_file)
+        added = queue.fill()
+        queued, leased, given_up = queue.counts()
         console.print(
-            f"Processing message {count} - {msg_date_flat}",
+            f"Worker {queue.worker_id}: {queued} jobs queued ({added} new), "
+            f"{leased} held by other workers, {given_up} given up on.",
             style=info_style,
         )
-        from_hash = hashlib.sha256(message[1].encode("utf-8")).hexdigest()
-        sql = "SELECT 1 FROM email_facts WHERE fact_hash = ? LIMIT 1"
-        cursor.execute(sql, (from_hash,))
-        row_exists = cursor.fetchone() is not None
-        if not row_exists:
-            # print(message)
-            payload = remove_blank_lines(message[7])
-            # Square brackets cause problems with rich printing
-            payload = payload.replace("[", "(").replace("]", ")")
-            msg_date = parser.parse(message[2])
-            sender = message[3]
-            receiver = message[4]
-            subject = message[5]
-            if payload.isspace():
-                console.print("There is no message in the email.", style=error_style)
+        queue.start()
+        messages = queue.messages()
+    else:
+        # Payloads are only decompressed for messages that still need facts.
+        pending, messages = pending_messages(connection)
+        console.print(f"{pending} messages without facts.", style=info_style)
+    console.print(
+        f"Creating fact(s) related to {config.your_name}, {args.concurrency} at a time, "
+        f"with {args.llm_url}.",
+        style=info_style,
+    )
+    jobs = pending_jobs(
+        messages=messages,
+        console=console,
+        max_tokens=args.max_tokens,
+        max_chunks=args.max_chunks,
+        on_skip=queue.complete if queue else None,
+    )
+    # Prompts run in threads, results are written here as they come in.
+    results = chain.from_iterable(
+        run_bounded(
+            lambda batch: extract_batch(
+                batch=batch, timeout=args.timeout, retries=args.retries, base_url=args.llm_url
+            ),
+            batch_jobs(jobs, max_tokens=args.batch_tokens, max_size=args.batch_size),
+            concurrency=args.concurrency,
+        )
+    )
+    processed = split_count = truncated_count = tokens_sent = tokens_saved = 0
+    batched_count = fallback_count = 0
+    try:
+        for job, facts, elapsed_time in results:
+            if facts is None:
+                # Nothing written, so the next run (or another worker) tries again.
+                if queue is not None:
+                    queue.release(job["msg_id"])
                 continue
-            console.print(f"Creating fact(s) related to {config.your_name}.", style=info_style)
-            start_time = time.perf_counter()
-            facts = do_facts(
-                message=payload,
-                msg_date=msg_date,
-                subject=subject,
-                sender=sender,
-                receiver=receiver,
-            )
-            # print(facts)
-            end_time = time.perf_counter()
-            elapsed_time = round((end_time - start_time), 3)
-
             console.print(f"Time spent find facts: {elapsed_time}", style=info_style)
+            processed += 1
+            tokens_sent += job["tokens"] - job["tokens_dropped"]
+            batched_count += job.get("batched", False)
+            fallback_count += job.get("batch_fallback", False)
+            if len(job["chunks"]) > 1:
+                split_count += 1
+            if job["tokens_dropped"]:
+                truncated_count += 1
+                tokens_saved += job["tokens_dropped"]
+                console.print(
+                    f"Body over budget, dropped ~{job['tokens_dropped']} tokens", style=info_style
+                )
 
             try:
-                start = facts.index("{")
-                end = facts.rindex("}") + 1
-                json_str = facts[start:end]
                 # loads and dumps to flatten the json, really...
-                checked_json = json.dumps(json.loads(json_str))
+                checked_json = json.dumps(parse_facts_json(facts))
 
             except (ValueError, json.JSONDecodeError) as e:
                 console.print(f"Error extracting JSON: {e}", style=error_style)
@@ -227,12 +595,41 @@ if __name__ == "__main__":
 
             console.print(f"Writing fact: {checked_json}", style=success_style)
             write_msg_to_db(
-                fact_hash=f"{from_hash}",
-                fact_date=message[1],
-                msg_from=message[0],
+                fact_hash=f"{job['fact_hash']}",
+                fact_date=job["fact_date"],
+                msg_from=job["msg_from"],
                 facts=checked_json,
                 table_name="email_facts",
                 connection=connection,
             )
+            if queue is not None:
+                queue.complete(job["msg_id"])
 
             console.print("─" * 40, style=line_style)
+    finally:
+        if queue is not None:
+            given_up = queue.counts()[2]
+            queue.stop()
+
+    console.print(
+        f"{processed} messages, ~{tokens_sent} body tokens sent. "
+        f"{split_count} split into chunks, {truncated_count} truncated, "
+        f"~{tokens_saved} prompt tokens saved.",
+        style=info_style,
+    )
+    if queue is not None and queue.lease_error:
+        console.print(f"Stopped early, other workers may take over: {queue.lease_error}", style=error_style)
+    if queue is not None and given_up:
+        console.print(
+            f"{given_up} messages failed {queue.max_attempts} times and were given up on. "
+            f"Delete their {QUEUE_TABLE} rows to try them again.",
+            style=info_style,
+        )
+    if args.batch_tokens > 0:
+        console.print(
+            f"{batched_count} answered in batches, {fallback_count} sent on their own after a batch failed.",
+            style=info_style,
+        )
+    if llm_cache is not None:
+        for line in llm_cache.report():
+            console.print(line, style=info_style)
@@ -14,7 +14,9 @@ from rich.console import Console
 from langchain.docstore.document import Document
 
 import config
-from utilities import remove_non_ascii, embed_str
+from email_store import PENDING_EMBEDDINGS_SQL
+from llm_metrics import enable_llm_metrics, record_llm_call
+from utilities import remove_non_ascii, embed_str, estimate_tokens
 
 
 def create_tables():
@@ -155,6 +157,7 @@ if __name__ == "__main__":
         "--verbose", "-v", help="Increase Verbosity of output", action="store_true"
     )
     args = argparser.parse_args()
+    enable_llm_metrics()
 
     # If the file doesn't exist stop.
     if not os.path.isfile(config.sqlite_email_file):
@@ -170,13 +173,11 @@ if __name__ == "__main__":
     if not table_exists(connection=connection, table_name="email_embedded"):
         create_tables()
 
-    sql = "SELECT * FROM email_facts ORDER BY facts DESC;"
-    cursor = connection.cursor()
-
-    cursor.execute(sql)
-    messages = cursor.fetchall()
-    total_files = len(messages)
+    total_files = connection.execute(f"SELECT count(*) {PENDING_EMBEDDINGS_SQL}").fetchone()[0]
     print(total_files)
+    # Streamed, only pending facts are read. Embeddings are written on this
+    # connection while the cursor is open, always for rows it already returned.
+    messages = connection.execute(f"SELECT f.* {PENDING_EMBEDDINGS_SQL}")
     the_keys = []
     for count, message in enumerate(messages):
         console.print(
@@ -184,45 +185,49 @@ if __name__ == "__main__":
                 count, remove_non_ascii(message[1].replace("\r", ""))
             )
         )
-        fact_hash=message[0]
-        sql = "SELECT 1 FROM email_embedded WHERE fact_hash = ? LIMIT 1"
-        cursor.execute(sql, (fact_hash,))
-        row_exists = cursor.fetchone() is not None
-        if not row_exists:
-            total_files -= 1
-            start_time = time.perf_counter()
-            start_time2 = time.perf_counter()
-
-            json_data = json.loads(message[3])
-            if not json_data:
-                console.print(f"Skipping. No data. {message[3]}")
-            else:
-                flat_facts = flatten_json_for_embedding(json_data)
-                # print(flat_facts)
-                console.print(
-                    "[bright_cyan]---------------------------------------------------------------------------------------------"
-                )
-
-                embeddings = embed_str(data_point=flat_facts)
-                pickled_embeddings = pickle.dumps(embeddings)
-                end_time = time.perf_counter()
-                elapsed_time = round((end_time - start_time), 3)
-                print(f"Writing fact: {message[0]}")
-                write_msg_to_db(
-                    fact_hash=message[0],
-                    fact_date=message[1],
-                    msg_from=message[2],
-                    facts=message[3],
-                    embeddings=pickled_embeddings,
-                    table_name="email_embedded",
-                    connection=connection,
-                )
-
-            end_time2 = time.perf_counter()
-            elapsed_time2 = round((end_time2 - start_time2), 3)
-            # print(f"Embedding time: {elapsed_time} - Total time: {elapsed_time2} seconds")
-
-            # print(f"Total files left {total_files}.")
-            # sys.stdout.write("Files left: %d files   \r" % (total_files))
-            # sys.stdout.flush()
+        total_files -= 1
+        start_time = time.perf_counter()
+        start_time2 = time.perf_counter()
+
+        json_data = json.loads(message[3])
+        if not json_data:
+            console.print(f"Skipping. No data. {message[3]}")
+        else:
+            flat_facts = flatten_json_for_embedding(json_data)
+            # print(flat_facts)
+            console.print(
+                "[bright_cyan]---------------------------------------------------------------------------------------------"
+            )
+
+            started = time.time()
+            embeddings = embed_str(data_point=flat_facts)
+            record_llm_call(
+                "embed",
+                config.llm_embeddings_model,
+                config.llm_url,
+                started,
+                time.time() - started,
+                prompt_tokens=estimate_tokens(flat_facts),
+            )
+            pickled_embeddings = pickle.dumps(embeddings)
+            end_time = time.perf_counter()
+            elapsed_time = round((end_time - start_time), 3)
+            print(f"Writing fact: {message[0]}")
+            write_msg_to_db(
+                fact_hash=message[0],
+                fact_date=message[1],
+                msg_from=message[2],
+                facts=message[3],
+                embeddings=pickled_embeddings,
+                table_name="email_embedded",
+                connection=connection,
+            )
+
+        end_time2 = time.perf_counter()
+        elapsed_time2 = round((end_time2 - start_time2), 3)
+        # print(f"Embedding time: {elapsed_time} - Total time: {elapsed_time2} seconds")
+
+        # print(f"Total files left {total_files}.")
+        # sys.stdout.write("Files left: %d files   \r" % (total_files))
+        # sys.stdout.flush()
     # print(set(the_keys))
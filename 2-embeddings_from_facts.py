@@ -37,19 +37,22 @@ import time
 from dateutil import parser
 
 from langchain.docstore.document import Document
-from langchain_community.chat_models import ChatOllama
-from langchain_community.embeddings import OllamaEmbeddings
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_text_splitters import CharacterTextSplitter
 
 import config
-from utilities import load_json, save_doc, gather_files
+from llm_cache import enable_llm_cache
+from utilities import get_chat_model, get_embeddings, load_json, save_doc, gather_files
 
 
 
 
 
+# Built on first use and reused for every fact.
+truthiness_chain = None
+
+
 def check_truthiness(fact):
     prompt = """
         You are a professional editor.
@@ -65,15 +68,14 @@ def check_truthiness(fact):
         {fact}
         """
 
-    llm = ChatOllama(
-        model=config.llm_recheck_model, base_url=config.llm_url, keep_alive=-1
-    )
-
-    prompt_template = ChatPromptTemplate.from_template(prompt)
-    chain = prompt_template | llm | StrOutputParser()
-    torf = chain.invoke(
+    global truthiness_chain
+    if truthiness_chain is None:
+        llm = get_chat_model(config.llm_recheck_model, keep_alive=-1)
+        prompt_template = ChatPromptTemplate.from_template(prompt)
+        truthiness_chain = prompt_template | llm | StrOutputParser()
+    torf = truthiness_chain.invoke(
         {
-            "fact": item,
+            "fact": fact,
             "your_short_name": config.your_short_names[0],
             "your_name": config.your_name,
         }
@@ -104,6 +106,7 @@ if __name__ == "__main__":
     )
 
     args = argparser.parse_args()
+    llm_cache = enable_llm_cache()
 
     if len(sys.argv) == 1:
         argparser.print_help()
@@ -121,10 +124,7 @@ if __name__ == "__main__":
         the_facts_dir = config.journal_facts_dir
         the_embeddings_dir = config.journal_embeddings_dir
 
-    embeddings = OllamaEmbeddings(
-        model=config.llm_embeddings_model,
-        base_url=config.llm_url,
-    )
+    embeddings = get_embeddings(prefixed=True)
 
     all_files, total_files = gather_files(file_path=the_facts_dir)
 
@@ -185,4 +185,7 @@ if __name__ == "__main__":
             sys.stdout.write("Files left: %d files   \r" % (total_files))
             sys.stdout.flush()
 
+    if llm_cache is not None:
+        for line in llm_cache.report():
+            print(line)
     print("Done!")
@@ -31,21 +31,31 @@ import os
 import sys
 
 from langchain.docstore.document import Document
-from langchain_community.chat_models import ChatOllama
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_experimental.graph_transformers import LLMGraphTransformer
-from langchain_experimental.llms.ollama_functions import OllamaFunctions
 from rich import print
 from rich.console import Console
 
 import config
-from utilities import gather_files, is_id_in_names, load_json, save_doc
+from llm_cache import enable_llm_cache
+from utilities import (
+    gather_files,
+    get_chat_model,
+    get_graph_transformer,
+    is_id_in_names,
+    load_json,
+    save_doc,
+)
 
 # import langchain
 
 
 # langchain.debug=True
+
+# Built on first use and reused for every fact.
+truthiness_chain = None
+
+
 def check_truthiness(fact):
     prompt = """
         You are a professional editor.
@@ -61,15 +71,14 @@ def check_truthiness(fact):
         {fact}
         """
 
-    llm = ChatOllama(
-        model=config.llm_recheck_model, base_url=config.llm_url, keep_alive=-1
-    )
-
-    prompt_template = ChatPromptTemplate.from_template(prompt)
-    chain = prompt_template | llm | StrOutputParser()
-    torf = chain.invoke(
+    global truthiness_chain
+    if truthiness_chain is None:
+        llm = get_chat_model(config.llm_recheck_model, keep_alive=-1)
+        prompt_template = ChatPromptTemplate.from_template(prompt)
+        truthiness_chain = prompt_template | llm | StrOutputParser()
+    torf = truthiness_chain.invoke(
         {
-            "fact": item,
+            "fact": fact,
             "your_short_name": config.your_short_names[0],
             "your_name": config.your_name,
         }
@@ -101,6 +110,7 @@ if __name__ == "__main__":
     )
 
     args = argparser.parse_args()
+    llm_cache = enable_llm_cache()
 
     if len(sys.argv) == 1:
         argparser.print_help()
@@ -118,7 +128,9 @@ if __name__ == "__main__":
         the_facts_dir = config.journal_facts_dir
         the_graphs_dir = config.journal_graphs_dir
 
-    llm2 = OllamaFunctions(model=config.llm_relationship_model, base_url=config.llm_url)
+    llm_transformer = get_graph_transformer(
+        config.llm_relationship_model, node_properties=True, relationship_properties=True
+    )
 
     with console.status("Loading Facts..."):
         all_files, total_files = gather_files(file_path=the_facts_dir)
@@ -158,10 +170,6 @@ if __name__ == "__main__":
             out_json_file = f"{the_graphs_dir}/{new_hash}.json"
 
             if not os.path.isfile(out_json_file):
-                llm_transformer = LLMGraphTransformer(
-                    llm=llm2, node_properties=True, relationship_properties=True
-                )
-
                 try:
                     with console.status("Generating graph document..."):
                         graph_documents = llm_transformer.convert_to_graph_documents(
@@ -197,3 +205,7 @@ if __name__ == "__main__":
             else:
                 print("{} exists.".format(out_json_file))
         print(f"{total_files} total files remaining to process...")
+
+    if llm_cache is not None:
+        for line in llm_cache.report():
+            print(line)
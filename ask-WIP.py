@@ -15,7 +15,7 @@ from rich.prompt import Prompt
 
 import config
 
-from utilities import embed_str
+from utilities import embed_str, get_chat_model
 
 # import langchain
 # langchain.debug = True
@@ -91,9 +91,9 @@ if __name__ == "__main__":
 
     questions = []
 
-    llm = ChatOllama(model=config.llm_asking_model, base_url=config.llm_url)
+    llm = get_chat_model(config.llm_asking_model)
 
-    llm_cypher = ChatOllama(model=config.llm_cypher_model, base_url=config.llm_url)
+    llm_cypher = get_chat_model(config.llm_cypher_model)
 
     # Convert documents to Embeddings and store them
     vectorstore = Qdrant.from_existing_collection(
@@ -20,6 +20,7 @@ Inputs
         - A specific question
         - "Random" to generate a random question
         - "Introspective" to generate a light-hearted introspective question
+        - "Search <words>" to keyword search the email DB (needs sqlite-fts_index.py)
         - An empty string to repeat the previous question
 - Context data: The system uses pre-existing knowledge graph data (stored in a Neo4j database)
     and document embeddings (stored in Qdrant) to provide context for generated questions.
@@ -28,10 +29,12 @@ Outputs
 
 - Generated question: When the user inputs "Random" or "Introspective", the system generates
     a new question based on the provided context.
+- Search results: Matching facts and emails from the SQLite full-text index.
 - Answer: The system processes the user's input query through the Ollama Chat Model and
     returns an answer in plain text format.
 """
 
+import os
 import warnings
 
 from langchain_core.output_parsers import StrOutputParser
@@ -39,16 +42,17 @@ from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import RunnablePassthrough
 from langchain_qdrant import Qdrant
 
-from langchain_ollama import ChatOllama
-
 from langchain.chains import GraphCypherQAChain
 from langchain_community.graphs import Neo4jGraph
 
 from rich import print
 from rich.console import Console
+from rich.text import Text
 from rich.prompt import Prompt
 
-from utilities import embed_str
+from email_store import connect, fts_enabled, search_emails, search_facts
+from llm_cache import enable_llm_cache
+from utilities import embed_str, get_chat_model
 
 import config
 
@@ -62,7 +66,10 @@ if __name__ == "__main__":
     console.clear()
 
     questions = []
-    model_local = ChatOllama(model=config.llm_asking_model, base_url=config.llm_url)
+    enable_llm_cache()
+    model_local = get_chat_model(config.llm_asking_model)
+    # Random and follow-up questions should differ each time, never cache them.
+    question_model = get_chat_model(config.llm_asking_model, cache=False)
 
     # Convert documents to Embeddings and store them
     vectorstore = Qdrant.from_existing_collection(
@@ -78,8 +85,8 @@ if __name__ == "__main__":
     #     password=config.neo4j_pw,
     # )
 
-    llm = ChatOllama(model=config.llm_model, base_url=config.llm_url)
-    llm_cypher = ChatOllama(model=config.llm_cypher_model, base_url=config.llm_url)
+    llm = get_chat_model(config.llm_model)
+    llm_cypher = get_chat_model(config.llm_cypher_model)
 
     # prompt_template = """
     # Adhere to these instructions:
@@ -152,15 +159,22 @@ Answer:
             "your_name": lambda x: config.your_name,
         }
         | prompt2
-        | model_local
+        | question_model
         | StrOutputParser()
     )
 
+    fts_connection = None
+    if os.path.isfile(config.sqlite_email_file):
+        fts_connection = connect(config.sqlite_email_file)
+        if not fts_enabled(fts_connection):
+            fts_connection.close()
+            fts_connection = None
+
     random_question = ""
     followup = ""
     while True:
         print(
-            "[deep_sky_blue1]Enter 'exit', 'quit' or 'q' to quit. Enter 'random' if you would like the AI to generate a question, 'introspective' for introspective.\n"
+            "[deep_sky_blue1]Enter 'exit', 'quit' or 'q' to quit. Enter 'random' if you would like the AI to generate a question, 'introspective' for introspective, 'search <words>' to search your email.\n"
         )
         user_input = Prompt.ask(
             "[dodger_blue2]What would you like to know? => [orange1]"
@@ -192,6 +206,29 @@ Answer:
                 f"[dodger_blue2]Okay. Asking random question: \n\n [orange1]{user_input}"
             )
 
+        # Just "search", a question can start with any short word.
+        elif user_input.lower().strip().split(" ")[0] == "search":
+            words = user_input.strip().partition(" ")[2]
+            if fts_connection is None:
+                console.print(
+                    "[orange1]No full-text index found. Run sqlite-fts_index.py first.\n"
+                )
+                continue
+            for fact_hash, fact_date, msg_from, facts in search_facts(
+                fts_connection, words, limit=10
+            ):
+                # Not markup, facts and subjects often have [list-tags] in them.
+                console.print(Text.assemble((f"{fact_date}: ", "dodger_blue2"), (facts, "turquoise2")))
+            for msg in search_emails(fts_connection, words, limit=10):
+                console.print(
+                    Text.assemble(
+                        (f"{msg.msg_date} {msg.sender}: ", "dodger_blue2"),
+                        (msg.subject or "", "turquoise2"),
+                    )
+                )
+            print()
+            continue
+
         elif user_input == "":
             console.print(f"[dodger_blue2]Asking: [orange1]{followup}")
             user_input = followup
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+What it does:
+
+Micro-benchmark for the email signature/reply stripping in 1.0. Compares the
+old line-by-line clean_up_msg loop (copied below as legacy_clean_up) with
+utilities.SignatureStripper on a corpus of email bodies, and checks that both
+produce the same text.
+
+Inputs:
+
+    --mbox FILE   Take the text/plain bodies from an mbox file.
+    --count N     Otherwise, generate N sample bodies. Default 2000.
+    --repeat N    Timing rounds, the best one is reported. Default 5.
+
+Outputs:
+
+    Seconds per corpus for each implementation, the speedup and any mismatches.
+"""
+
+import argparse
+import random
+import re
+import timeit
+
+from mbox_reader import MboxReader, message_from_bytes
+from utilities import SignatureStripper
+
+
+def legacy_clean_up(payload: str) -> str:
+    """The clean_up_msg loop from 1.0 before the single pass stripper, minus the prints."""
+    flag = True
+    while flag:
+        lines = payload.split("\n")
+        cleaned_lines = []
+
+        for line in lines:
+            flag = False
+            if re.match(r".*--.*Original Message.*--.*", line):
+                flag = True
+                break
+            if re.match(r"On.*wrote:", line):
+                flag = True
+                break
+            if re.match(r".*--.*Forwarded Message.*--.*", line):
+                flag = True
+                break
+            if line.startswith("--"):
+                flag = True
+                break
+            if line.startswith("m!"):
+                flag = True
+                break
+            if re.match(r"^ttul,$", line):
+                flag = True
+                break
+            if line.startswith("k;"):
+                flag = True
+                break
+            if re.match(r"^Cheers$", line):
+                flag = True
+                break
+            cleaned_lines.append(line)
+
+        payload = "\n".join(cleaned_lines)
+    return payload
+
+
+def sample_bodies(count: int) -> list:
+    """Deterministic bodies shaped like real mail: short notes, long threads, sigs."""
+    rng = random.Random(42)
+    words = "the a meeting lunch tomorrow project thanks please review code dog trip".split()
+    endings = [
+        "",
+        "Cheers\nSam",
+        "-- \nSam Smith\nSome Company",
+        "On Tue, Jan 4, 2022 at 10:00 AM Someone <someone@example.com> wrote:\n> earlier mail\n> more",
+        "-----Original Message-----\nFrom: Someone\nSent: Monday\n\nold text",
+        "---------- Forwarded Message ----------\nforwarded text",
+        "ttul,\nSam",
+    ]
+    bodies = []
+    for _ in range(count):
+        lines = [
+            " ".join(rng.choice(words) for _ in range(rng.randint(3, 15)))
+            for _ in range(rng.choice([2, 5, 20, 80]))
+        ]
+        bodies.append("\n".join(lines + [rng.choice(endings)]))
+    return bodies
+
+
+def mbox_bodies(mbox_file: str) -> list:
+    bodies = []
+    # A benchmark shouldn't leave a .idx file next to the user's mbox.
+    with MboxReader(mbox_file, use_index=False) as reader:
+        for raw_message in reader:
+            for part in message_from_bytes(raw_message).walk():
+                if part.get_content_type() == "text/plain":
+                    payload = part.get_payload(decode=True) or b""
+                    bodies.append(payload.decode("utf-8", errors="replace"))
+    return bodies
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Benchmark email signature stripping.")
+    argparser.add_argument("--mbox", help="Use the bodies from this mbox file")
+    argparser.add_argument("--count", type=int, default=2000, help="Generated bodies")
+    argparser.add_argument("--repeat", type=int, default=5, help="Timing rounds")
+    args = argparser.parse_args()
+
+    bodies = mbox_bodies(args.mbox) if args.mbox else sample_bodies(args.count)
+    stripper = SignatureStripper()
+
+    mismatches = sum(
+        legacy_clean_up(body) != stripper.strip(body)[0] for body in bodies
+    )
+
+    legacy = min(
+        timeit.repeat(lambda: [legacy_clean_up(b) for b in bodies], number=1, repeat=args.repeat)
+    )
+    single = min(
+        timeit.repeat(lambda: [stripper.strip(b) for b in bodies], number=1, repeat=args.repeat)
+    )
+
+    print(f"{len(bodies)} bodies, {sum(map(len, bodies))} characters")
+    print(f"legacy clean_up_msg:   {legacy:.4f}s")
+    print(f"SignatureStripper:     {single:.4f}s")
+    print(f"Speedup:               {legacy / single:.1f}x")
+    print(f"Mismatched outputs:    {mismatches}")
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+What it does:
+
+Micro-benchmark for the LLM client registry in utilities. Compares building a
+new ChatOllama/OllamaEmbeddings for every call, the way the scripts used to,
+with getting the shared client from get_chat_model()/get_embeddings().
+
+Without --live only the client setup is timed, no server is needed. With
+--live each round also makes a real embedding request to Ollama, so the cost
+of new HTTP connections versus kept-alive ones shows up too.
+
+Inputs:
+
+    --count N   Calls per round. Default 200 (20 with --live).
+    --repeat N  Timing rounds, the best one is reported. Default 5.
+    --live      Also send an embedding request per call to config.llm_url.
+
+Outputs:
+
+    Microseconds per call for each way and the overhead the registry removes.
+"""
+
+import argparse
+import timeit
+
+from langchain_ollama import ChatOllama, OllamaEmbeddings
+
+import config
+from utilities import get_chat_model, get_embeddings
+
+
+def per_call_setup():
+    ChatOllama(model=config.llm_facts_model, base_url=config.llm_url, keep_alive=-1)
+    return OllamaEmbeddings(model=config.llm_embeddings_model, base_url=config.llm_url)
+
+
+def registry_setup():
+    get_chat_model(config.llm_facts_model, keep_alive=-1)
+    return get_embeddings()
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Benchmark LLM client setup.")
+    argparser.add_argument("--count", type=int, help="Calls per round")
+    argparser.add_argument("--repeat", type=int, default=5, help="Timing rounds")
+    argparser.add_argument(
+        "--live", action="store_true", help="Make a real embedding request per call"
+    )
+    args = argparser.parse_args()
+    count = args.count or (20 if args.live else 200)
+
+    if args.live:
+        def per_call():
+            per_call_setup().embed_query("benchmark")
+
+        def registry():
+            registry_setup().embed_query("benchmark")
+    else:
+        per_call = per_call_setup
+        registry = registry_setup
+
+    # Warm up: first request loads the model, first registry call builds the clients.
+    registry()
+    per_call()
+
+    old = min(timeit.repeat(per_call, number=count, repeat=args.repeat)) / count
+    new = min(timeit.repeat(registry, number=count, repeat=args.repeat)) / count
+
+    print(f"{count} calls per round, {'with' if args.live else 'without'} requests to {config.llm_url}")
+    print(f"New clients per call:  {old * 1000000:.0f}us per call")
+    print(f"Shared clients:        {new * 1000000:.0f}us per call")
+    print(f"Overhead removed:      {(old - new) * 1000000:.0f}us per call ({old / new:.1f}x)")
@@ -21,6 +21,10 @@ neo4j_pw = ""
 sqlite_dir = f"{data_dir}/sqlite"
 sqlite_email_file = f"{sqlite_dir}/introspect_ai_email.db"
 
+# Compress email payloads and headers in sqlite. None, "zlib" or "zstd" (needs
+# the zstandard package). Use sqlite-compress_payloads.py to convert an existing DB.
+email_payload_compression = None
+
 # LLM
 llm_model = "phi4:latest"
 llm_cypher_model = "qwen2.5:14b"
@@ -30,6 +34,33 @@ llm_facts_model = "phi4:latest"
 llm_embeddings_model = "nomic-embed-text"
 llm_relationship_model = "granite3.1-dense:8b"
 llm_url = "http://localhost:11434"
+# LLM requests 1.1 keeps in flight at once. Set it to Ollama's OLLAMA_NUM_PARALLEL.
+llm_facts_concurrency = 1
+# Seconds before an LLM request is given up on, and how many times it's retried.
+llm_timeout = 300
+llm_retries = 2
+# Estimated tokens of email body per fact request, e.g. 3000. Longer emails are
+# split into up to llm_facts_max_chunks requests and the facts merged, the rest
+# is dropped. 0 sends every email whole.
+llm_facts_max_tokens = 0
+llm_facts_max_chunks = 4
+# 1.1: pack short emails into one prompt of up to this many tokens, at most
+# llm_facts_batch_size emails each. 0 sends every email on its own.
+llm_facts_batch_tokens = 0
+llm_facts_batch_size = 8
+# 1.1 --queue: messages each worker claims at a time, seconds a claim lasts
+# if its worker stops sending heartbeats, and claims before a message that
+# keeps failing is given up on.
+fact_queue_batch = 20
+fact_queue_lease = 120
+fact_queue_max_attempts = 5
+# LLM responses are cached in SQLite so re-runs skip prompts already answered.
+llm_cache = True
+llm_cache_file = f"{sqlite_dir}/llm_cache.db"
+llm_cache_max_mb = 512
+# Per call token counts and timings from 1.1 and 1.2, see llm_metrics.py.
+llm_metrics = True
+llm_metrics_file = f"{sqlite_dir}/llm_metrics.db"
 
 # Directories
 summaries_dir = f"{data_dir}/summaries"
@@ -57,6 +88,25 @@ blog_graphs_dir = f"{graphs_dir}/blog"
 # Openstreet lookup
 nominatim_url = ""
 
+# Email bodies are cut at the first line matching one of these, to drop
+# signatures, quoted replies and forwards. Each regex is matched at the start
+# of a line. Add your own sign-offs here. Start a rule with (?i) to make just
+# that rule case-insensitive.
+email_cut_rules = {
+    "Original Message": r".*--.*Original Message.*--.*",
+    "On...wrote:": r"On.*wrote:",
+    "Forward Message": r".*--.*Forwarded Message.*--.*",
+    "sig": r"--",
+    "m!": r"m!",
+    "ttul": r"ttul,$",
+    "k;": r"k;",
+    "Cheers": r"Cheers$",
+}
+
+# How 1.0 strips HTML from bodies that have markup. "fast" is a streaming
+# tag stripper, "bs4" is BeautifulSoup (slower, kept as a fallback).
+email_html_parser = "fast"
+
 emails_dict = {
     "example@example.com": "Example User",
     "another-example@example.com": "Example User",
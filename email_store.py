@@ -0,0 +1,305 @@
+"""
+What it does:
+
+Helpers for reading and writing the msgs/raw_msgs tables in the email sqlite DB.
+
+Payloads (and headers) can be stored compressed. Compressed values are BLOBs,
+plain ones are TEXT, so old rows and new rows can live side by side. Reads go
+through MsgRow, which only decompresses a column when it's asked for.
+
+Codecs:
+
+    None    Store TEXT as before.
+    "zlib"  Standard library, always available.
+    "zstd"  Needs the zstandard package. Faster and smaller than zlib.
+
+Full-text search:
+
+sqlite-fts_index.py creates FTS5 tables over msgs (subject, payload) and
+email_facts (facts), kept in sync by triggers. The triggers call email_text()
+to read compressed payloads, so anything writing to msgs or email_facts should
+open the DB with connect(). search_emails() and search_facts() query them.
+"""
+
+import hashlib
+import json
+import re
+import sqlite3
+import zlib
+from typing import Iterator, List, Optional, Tuple, Union
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+import config
+
+COMPRESSED_COLUMNS = ("payload", "headers")
+# Values shorter than this stay TEXT, compression wouldn't win anything.
+MIN_COMPRESS_SIZE = 64
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+_zstd_compressor = None
+_zstd_decompressor = None
+
+FTS_SQL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS msgs_fts USING fts5(subject, payload, tokenize = 'porter unicode61')""",
+    """CREATE TRIGGER IF NOT EXISTS msgs_fts_insert AFTER INSERT ON msgs BEGIN
+        INSERT INTO msgs_fts (rowid, subject, payload) VALUES (new.id, new.subject, email_text(new.payload));
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS msgs_fts_delete AFTER DELETE ON msgs BEGIN
+        DELETE FROM msgs_fts WHERE rowid = old.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS msgs_fts_update AFTER UPDATE OF subject, payload ON msgs BEGIN
+        DELETE FROM msgs_fts WHERE rowid = old.id;
+        INSERT INTO msgs_fts (rowid, subject, payload) VALUES (new.id, new.subject, email_text(new.payload));
+    END""",
+    # email_facts has no INTEGER PRIMARY KEY, so its rowids can change on VACUUM.
+    # Key the index on fact_hash instead.
+    """CREATE VIRTUAL TABLE IF NOT EXISTS email_facts_fts USING fts5(fact_hash UNINDEXED, facts, tokenize = 'porter unicode61')""",
+    """CREATE TRIGGER IF NOT EXISTS email_facts_fts_insert AFTER INSERT ON email_facts BEGIN
+        INSERT INTO email_facts_fts (fact_hash, facts) VALUES (new.fact_hash, new.facts);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS email_facts_fts_delete AFTER DELETE ON email_facts BEGIN
+        DELETE FROM email_facts_fts WHERE fact_hash = old.fact_hash;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS email_facts_fts_update AFTER UPDATE OF fact_hash, facts ON email_facts BEGIN
+        DELETE FROM email_facts_fts WHERE fact_hash = old.fact_hash;
+        INSERT INTO email_facts_fts (fact_hash, facts) VALUES (new.fact_hash, new.facts);
+    END""",
+]
+FTS_TABLES = ["msgs_fts", "email_facts_fts"]
+
+# What's left for 1.1 (msgs without facts) and 1.2 (facts without embeddings),
+# as "SELECT ... {PENDING_FACTS_SQL}". fact_hash is the sha256 of from_line,
+# worked out by the sha256() SQL function connect() registers. Facts that came
+# back empty are never embedded, so they aren't pending either.
+PENDING_FACTS_SQL = """FROM msgs m WHERE NOT EXISTS (
+    SELECT 1 FROM email_facts f WHERE f.fact_hash = sha256(m.from_line))"""
+PENDING_EMBEDDINGS_SQL = """FROM email_facts f WHERE f.facts != '{}' AND NOT EXISTS (
+    SELECT 1 FROM email_embedded e WHERE e.fact_hash = f.fact_hash)"""
+FTS_TRIGGERS = [
+    f"{table}_fts_{action}"
+    for table in ["msgs", "email_facts"]
+    for action in ["insert", "delete", "update"]
+]
+
+
+def payload_codec() -> Optional[str]:
+    """The codec configured with email_payload_compression, falling back to zlib if zstd isn't installed."""
+    codec = getattr(config, "email_payload_compression", None)
+    if codec == "zstd" and zstandard is None:
+        print("zstandard isn't installed, compressing payloads with zlib instead.")
+        return "zlib"
+    if codec not in (None, "zlib", "zstd"):
+        raise ValueError(f"Unknown email_payload_compression: {codec}")
+    return codec
+
+
+def compress_text(text: Optional[str], codec: Optional[str]) -> Union[str, bytes, None]:
+    if text is None or codec is None or len(text) < MIN_COMPRESS_SIZE:
+        return text
+    data = text.encode("utf-8", errors="surrogateescape")
+    if codec == "zstd":
+        global _zstd_compressor
+        if _zstd_compressor is None:
+            _zstd_compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+        return _zstd_compressor.compress(data)
+    return zlib.compress(data, ZLIB_LEVEL)
+
+
+def decompress_text(value: Union[str, bytes, None]) -> Optional[str]:
+    """Turns a stored payload/headers value back into text, whatever way it was stored."""
+    if not isinstance(value, bytes):
+        return value
+    if value.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise RuntimeError("This DB has zstd compressed payloads. pip install zstandard")
+        global _zstd_decompressor
+        if _zstd_decompressor is None:
+            _zstd_decompressor = zstandard.ZstdDecompressor()
+        data = _zstd_decompressor.decompress(value)
+    else:
+        data = zlib.decompress(value)
+    return data.decode("utf-8", errors="surrogateescape")
+
+
+def fact_hash(from_line: str) -> str:
+    """The email_facts key for a message."""
+    return hashlib.sha256(from_line.encode("utf-8")).hexdigest()
+
+
+def connect(db_file: str = None, timeout: float = 5.0) -> sqlite3.Connection:
+    """
+    Opens the email DB with email_text() registered for the FTS triggers and
+    sha256() for PENDING_FACTS_SQL.
+    """
+    connection = sqlite3.connect(db_file or config.sqlite_email_file, timeout=timeout)
+    connection.create_function("email_text", 1, decompress_text, deterministic=True)
+    connection.create_function("sha256", 1, fact_hash, deterministic=True)
+    return connection
+
+
+def encode_headers(headers: Union[str, list, None]) -> Optional[str]:
+    """Headers are stored as a JSON list of [name, value] pairs. Strings are assumed to be stored already."""
+    if headers is None or isinstance(headers, str):
+        return headers
+    return json.dumps([[name, str(value)] for name, value in headers])
+
+
+def decode_headers(value: Union[str, bytes, None]) -> Union[List[list], str, None]:
+    """
+    Returns the [name, value] pairs for a stored headers value. Rows written
+    before headers were JSON come back as the old string.
+    """
+    text = decompress_text(value)
+    if text is None:
+        return None
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+class MsgRow:
+    """
+    A row from msgs or raw_msgs. Works like the tuple sqlite returns
+    (row[7] is still the payload) and by column name, but compressed
+    columns are decompressed the first time they're read.
+    """
+
+    __slots__ = ("_values", "_columns", "_decoded")
+
+    def __init__(self, values: tuple, columns: List[str]):
+        self._values = values
+        self._columns = columns
+        self._decoded = {}
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __iter__(self):
+        return (self[index] for index in range(len(self._values)))
+
+    def __getitem__(self, key):
+        index = key if isinstance(key, int) else self._columns.index(key)
+        if self._columns[index] not in COMPRESSED_COLUMNS:
+            return self._values[index]
+        if index not in self._decoded:
+            self._decoded[index] = decompress_text(self._values[index])
+        return self._decoded[index]
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except ValueError:
+            raise AttributeError(name) from None
+
+
+def read_rows(cursor) -> Iterator[MsgRow]:
+    """Yields MsgRows from an executed cursor, one at a time."""
+    columns = [description[0] for description in cursor.description]
+    for values in cursor:
+        yield MsgRow(values, columns)
+
+
+def fts_enabled(connection: sqlite3.Connection) -> bool:
+    cursor = connection.execute(
+        "SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name IN (?, ?)",
+        FTS_TABLES,
+    )
+    return cursor.fetchone()[0] == len(FTS_TABLES)
+
+
+def create_fts(connection: sqlite3.Connection) -> Tuple[int, int]:
+    """
+    Creates the FTS tables and triggers and indexes what's already there.
+    The connection must come from connect().
+
+    Returns:
+        tuple: Rows indexed from msgs and from email_facts.
+    """
+    cursor = connection.cursor()
+    for sql in FTS_SQL:
+        cursor.execute(sql)
+    cursor.execute("DELETE FROM msgs_fts")
+    cursor.execute(
+        "INSERT INTO msgs_fts (rowid, subject, payload) SELECT id, subject, email_text(payload) FROM msgs"
+    )
+    msgs_indexed = cursor.rowcount
+    cursor.execute("DELETE FROM email_facts_fts")
+    cursor.execute(
+        "INSERT INTO email_facts_fts (fact_hash, facts) SELECT fact_hash, facts FROM email_facts"
+    )
+    facts_indexed = cursor.rowcount
+    connection.commit()
+    cursor.close()
+    return msgs_indexed, facts_indexed
+
+
+def drop_fts(connection: sqlite3.Connection):
+    cursor = connection.cursor()
+    for trigger in FTS_TRIGGERS:
+        cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    for table in FTS_TABLES:
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    connection.commit()
+    cursor.close()
+
+
+def fts_query(text: str, raw: bool = False) -> str:
+    """
+    Turns free text into an FTS5 query that matches all the words. Every word
+    is quoted, so quotes, AND/OR/NOT/NEAR or punctuation in user input can't
+    trip over FTS syntax. A trailing * still matches on the prefix. With raw
+    the text is taken as an FTS5 query and passed through as is.
+    """
+    if raw:
+        return text.strip()
+    terms = []
+    for word in text.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*")
+        if not re.search(r"\w", word):
+            continue
+        # Inside FTS5 quotes only " is special, and it's escaped by doubling.
+        term = '"' + word.replace('"', '""') + '"'
+        terms.append(term + "*" if prefix else term)
+    return " ".join(terms)
+
+
+def search_emails(
+    connection: sqlite3.Connection, text: str, limit: int = 20, raw: bool = False
+) -> List[MsgRow]:
+    """
+    Best keyword matches in msgs subjects and bodies, as MsgRows. A raw
+    query with bad FTS5 syntax raises sqlite3.OperationalError.
+    """
+    query = fts_query(text, raw=raw)
+    if not query:
+        return []
+    cursor = connection.execute(
+        """SELECT msgs.* FROM msgs_fts JOIN msgs ON msgs.id = msgs_fts.rowid
+        WHERE msgs_fts MATCH ? ORDER BY msgs_fts.rank LIMIT ?""",
+        (query, limit),
+    )
+    return list(read_rows(cursor))
+
+
+def search_facts(
+    connection: sqlite3.Connection, text: str, limit: int = 20, raw: bool = False
+) -> List[tuple]:
+    """Best keyword matches in email_facts, as (fact_hash, fact_date, msg_from, facts). raw as for search_emails."""
+    query = fts_query(text, raw=raw)
+    if not query:
+        return []
+    cursor = connection.execute(
+        """SELECT email_facts.fact_hash, email_facts.fact_date, email_facts.msg_from, email_facts.facts
+        FROM email_facts_fts JOIN email_facts ON email_facts.fact_hash = email_facts_fts.fact_hash
+        WHERE email_facts_fts MATCH ? ORDER BY email_facts_fts.rank LIMIT ?""",
+        (query, limit),
+    )
+    return cursor.fetchall()
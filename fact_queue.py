@@ -0,0 +1,216 @@
+"""
+What it does:
+
+A job queue in the email DB so several 1.1 processes, each with its own
+Ollama (--llm-url), can extract facts at the same time without doing any
+message twice.
+
+fill() adds a fact_jobs row for every msgs row without facts. Workers claim()
+batches of jobs by writing their worker id and a lease expiry on them, and a
+heartbeat thread keeps extending the lease while the worker is alive. If a
+worker dies its lease runs out and the jobs go to whoever claims next. If the
+heartbeat can't renew the leases in time, the worker stops handing out the
+jobs it holds (lease_error says why), as another worker may claim them.
+complete() removes a job once its facts are written, release() hands a failed
+one back. A job claimed fact_queue_max_attempts times is given up on and left
+in the table, counts() reports it. Delete its row to try it again.
+
+The DB is switched to WAL so the workers can read while one of them writes.
+
+Inputs:
+
+    fact_queue_batch  Jobs claimed at a time. Default 20.
+    fact_queue_lease  Seconds a claim lasts without a heartbeat. Default 120.
+    fact_queue_max_attempts  Claims per job before it's given up on. Default 5.
+
+Outputs:
+
+    The fact_jobs table.
+"""
+
+import os
+import socket
+import sqlite3
+import threading
+import time
+from typing import Iterator, List, Tuple
+
+import config
+from email_store import PENDING_FACTS_SQL, fact_hash, read_rows
+
+FACT_QUEUE_BATCH = getattr(config, "fact_queue_batch", 20)
+FACT_QUEUE_LEASE = getattr(config, "fact_queue_lease", 120)
+FACT_QUEUE_MAX_ATTEMPTS = getattr(config, "fact_queue_max_attempts", 5)
+# Seconds to wait on another worker's write before giving up.
+BUSY_TIMEOUT = 60
+
+QUEUE_TABLE = "fact_jobs"
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class FactQueue:
+    """
+    One worker's view of the fact_jobs queue. Use it from one thread, the
+    heartbeat has a connection of its own.
+    """
+
+    def __init__(
+        self,
+        db_file: str = None,
+        worker_id: str = None,
+        batch_size: int = FACT_QUEUE_BATCH,
+        lease_seconds: float = FACT_QUEUE_LEASE,
+        max_attempts: int = FACT_QUEUE_MAX_ATTEMPTS,
+    ):
+        self.db_file = db_file or config.sqlite_email_file
+        self.worker_id = worker_id or default_worker_id()
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.connection = self.connect()
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            f"""CREATE TABLE IF NOT EXISTS {QUEUE_TABLE} (msg_id INTEGER PRIMARY KEY, fact_hash TEXT,
+            worker TEXT, lease_expires REAL, attempts INTEGER DEFAULT 0)"""
+        )
+        self.connection.execute(
+            f"CREATE INDEX IF NOT EXISTS index_{QUEUE_TABLE}_worker ON {QUEUE_TABLE} (worker)"
+        )
+        self.stopping = threading.Event()
+        self.heartbeat_thread = None
+        self.lease_error = None
+
+    def connect(self) -> sqlite3.Connection:
+        # Autocommit, transactions are started explicitly with BEGIN IMMEDIATE.
+        connection = sqlite3.connect(
+            self.db_file, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False
+        )
+        connection.create_function("sha256", 1, fact_hash, deterministic=True)
+        return connection
+
+    def fill(self) -> int:
+        """Queues every message without facts that isn't queued yet. Safe to run from every worker."""
+        cursor = self.connection.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        # Jobs left behind by a worker that died between writing facts and completing them.
+        cursor.execute(
+            f"""DELETE FROM {QUEUE_TABLE} WHERE EXISTS (
+                SELECT 1 FROM email_facts f WHERE f.fact_hash = {QUEUE_TABLE}.fact_hash)"""
+        )
+        cursor.execute(
+            f"INSERT OR IGNORE INTO {QUEUE_TABLE} (msg_id, fact_hash) SELECT m.id, sha256(m.from_line) {PENDING_FACTS_SQL}"
+        )
+        added = cursor.rowcount
+        cursor.execute("COMMIT")
+        return added
+
+    def claim(self) -> List[int]:
+        """
+        Leases up to batch_size free or expired jobs to this worker, newest
+        messages first. Jobs already claimed max_attempts times are skipped.
+        """
+        now = time.time()
+        cursor = self.connection.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.execute(
+                f"""SELECT j.msg_id FROM {QUEUE_TABLE} j JOIN msgs m ON m.id = j.msg_id
+                WHERE (j.lease_expires IS NULL OR j.lease_expires < ?) AND j.attempts < ?
+                AND NOT EXISTS (SELECT 1 FROM email_facts f WHERE f.fact_hash = j.fact_hash)
+                ORDER BY m.msg_date DESC LIMIT ?""",
+                (now, self.max_attempts, self.batch_size),
+            )
+            msg_ids = [row[0] for row in cursor.fetchall()]
+            cursor.executemany(
+                f"UPDATE {QUEUE_TABLE} SET worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE msg_id = ?",
+                [(self.worker_id, now + self.lease_seconds, msg_id) for msg_id in msg_ids],
+            )
+            cursor.execute("COMMIT")
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            raise
+        return msg_ids
+
+    def messages(self) -> Iterator:
+        """
+        Claims batches and yields their msgs rows as MsgRows until there's
+        nothing left to claim. A batch is only claimed once the last one has
+        been handed out.
+        """
+        while not self.stopping.is_set():
+            msg_ids = self.claim()
+            if not msg_ids:
+                return
+            placeholders = ", ".join("?" * len(msg_ids))
+            cursor = self.connection.execute(
+                f"SELECT * FROM msgs WHERE id IN ({placeholders}) ORDER BY msg_date DESC", msg_ids
+            )
+            # Read the whole batch now. An open read would pin this connection to
+            # a snapshot, and complete() would then fail once another worker writes.
+            for message in list(read_rows(cursor)):
+                if self.stopping.is_set():
+                    return
+                yield message
+
+    def complete(self, msg_id: int):
+        """Drops a job whose facts have been written, or that has nothing to extract."""
+        self.connection.execute(
+            f"DELETE FROM {QUEUE_TABLE} WHERE msg_id = ? AND worker = ?", (msg_id, self.worker_id)
+        )
+
+    def release(self, msg_id: int):
+        """
+        Hands back a job that failed. It can be claimed again once a lease
+        period has passed, so a message that keeps failing isn't retried in a
+        tight loop.
+        """
+        self.connection.execute(
+            f"UPDATE {QUEUE_TABLE} SET worker = NULL, lease_expires = ? WHERE msg_id = ? AND worker = ?",
+            (time.time() + self.lease_seconds, msg_id, self.worker_id),
+        )
+
+    def heartbeat(self):
+        connection = self.connect()
+        interval = self.lease_seconds / 3
+        renewed = time.time()
+        # Renew well before the lease runs out, a slow write shouldn't cost us the batch.
+        while not self.stopping.wait(interval):
+            try:
+                connection.execute(
+                    f"UPDATE {QUEUE_TABLE} SET lease_expires = ? WHERE worker = ?",
+                    (time.time() + self.lease_seconds, self.worker_id),
+                )
+                renewed = time.time()
+            except sqlite3.Error as e:
+                # Try again next time, unless the leases would run out before then.
+                if time.time() + interval >= renewed + self.lease_seconds:
+                    self.lease_error = f"Leases not renewed since {time.ctime(renewed)}: {e}"
+                    self.stopping.set()
+        connection.close()
+
+    def start(self):
+        self.heartbeat_thread = threading.Thread(target=self.heartbeat, daemon=True)
+        self.heartbeat_thread.start()
+
+    def stop(self):
+        """Stops the heartbeat and releases whatever this worker still holds."""
+        self.stopping.set()
+        if self.heartbeat_thread is not None:
+            self.heartbeat_thread.join()
+        self.connection.execute(
+            f"UPDATE {QUEUE_TABLE} SET worker = NULL, lease_expires = NULL WHERE worker = ?",
+            (self.worker_id,),
+        )
+        self.connection.close()
+
+    def counts(self) -> Tuple[int, int, int]:
+        """Jobs queued, how many of them other live workers hold, and how many were given up on."""
+        queued, leased, given_up = self.connection.execute(
+            f"""SELECT count(*), coalesce(sum(lease_expires >= ? AND worker != ?), 0),
+            coalesce(sum(attempts >= ?), 0) FROM {QUEUE_TABLE}""",
+            (time.time(), self.worker_id, self.max_attempts),
+        ).fetchone()
+        return queued, leased, given_up
@@ -0,0 +1,332 @@
+"""
+What it does:
+
+A persistent LLM response cache in SQLite, plugged into LangChain's global
+cache so every chat model call goes through it: do_facts, check_truthiness,
+the graph transformer and the ask.py chains. Re-running a stage after a crash
+or a tweak that leaves the prompt alone costs nothing for the calls already made.
+
+Entries are keyed on the model, a hash of the rendered prompt and a hash of
+the model options. LangChain's llm_string for ChatOllama doesn't name the
+model or its options, so get_chat_model() gives each client a view of the
+cache keyed on the client's own fields: model, temperature, num_ctx and the
+other generation options (CLIENT_OPTIONS). The Ollama URL and per-process
+objects (HTTP pools) are left out, so any host and any run can hit the same
+entry, e.g. a message retried on another --llm-url after a crash. The least recently
+used entries are evicted once the responses add up to more than llm_cache_max_mb.
+
+Pass cache=False to get_chat_model() for calls that should never be cached,
+like ask.py's random questions.
+
+Inputs:
+
+    llm_cache_file    SQLite file for the cache. Default <sqlite_dir>/llm_cache.db
+    llm_cache_max_mb  Size limit for the stored responses. Default 512.
+    llm_cache         Set to False in config.py to turn the cache off.
+
+    Run it directly for the cache stats, or with --clear to empty it. --check
+    makes sure different models and options get different keys, and hosts don't.
+
+Outputs:
+
+    Cached responses, and hit rates from report().
+"""
+
+import argparse
+import datetime
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+from typing import List, Optional, Sequence, Tuple
+
+from langchain_core.caches import BaseCache
+from langchain_core.globals import get_llm_cache, set_llm_cache
+from langchain_core.load import dumps, loads
+from langchain_core.outputs import Generation
+
+import config
+
+LLM_CACHE_FILE = getattr(config, "llm_cache_file", f"{config.sqlite_dir}/llm_cache.db")
+LLM_CACHE_MAX_MB = getattr(config, "llm_cache_max_mb", 512)
+# Updates between size checks, so eviction doesn't run a SUM on every call.
+EVICT_CHECK_INTERVAL = 100
+
+# Object reprs with memory addresses, e.g. the shared httpx transport.
+OBJECT_REPR_PATTERN = re.compile(r"<[^<>]* at 0x[0-9a-fA-F]+>")
+BASE_URL_PATTERN = re.compile(r"""\(?['"]base_url['"][,:] ?['"][^'"]*['"]\)?,? ?""")
+MODEL_PATTERN = re.compile(r"""['"]model(?:_name)?['"][,:] ?['"]([^'"]*)['"]""")
+# Set in the response_metadata of answers that came from the cache, see was_cached().
+CACHED_METADATA_KEY = "llm_cache_hit"
+# ChatOllama fields that change the answer, part of every bound client's key.
+# Not base_url, the same model answers the same on any host.
+CLIENT_OPTIONS = (
+    "format",
+    "mirostat",
+    "mirostat_eta",
+    "mirostat_tau",
+    "num_ctx",
+    "num_predict",
+    "reasoning",
+    "repeat_last_n",
+    "repeat_penalty",
+    "seed",
+    "stop",
+    "temperature",
+    "tfs_z",
+    "top_k",
+    "top_p",
+)
+
+
+def options_key(llm_string: str) -> str:
+    """The llm_string LangChain builds for a model, minus the host and anything per-process."""
+    return BASE_URL_PATTERN.sub("", OBJECT_REPR_PATTERN.sub("<object>", llm_string))
+
+
+def model_name(llm_string: str) -> str:
+    match = MODEL_PATTERN.search(llm_string)
+    return match.group(1) if match else ""
+
+
+def sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8", errors="surrogateescape")).hexdigest()
+
+
+def client_key(llm) -> Tuple[str, str]:
+    """A chat model's name, and its CLIENT_OPTIONS as JSON."""
+    options = {option: getattr(llm, option, None) for option in CLIENT_OPTIONS}
+    return getattr(llm, "model", "") or "", json.dumps(options, sort_keys=True, default=str)
+
+
+class LLMResponseCache(BaseCache):
+    """
+    LangChain cache backed by a table in its own SQLite file. Safe to use from
+    the threads 1.1 runs requests in.
+    """
+
+    def __init__(self, db_file: str = LLM_CACHE_FILE, max_mb: float = LLM_CACHE_MAX_MB):
+        self.db_file = db_file
+        self.max_bytes = int(max_mb * 1048576)
+        # Several 1.1 --queue workers can share the cache, wait on each other's writes.
+        self.connection = sqlite3.connect(db_file, timeout=60, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS llm_cache (model TEXT, prompt_hash TEXT, options_hash TEXT,
+            response TEXT, size INTEGER, hits INTEGER DEFAULT 0, created TIMESTAMP, last_used TIMESTAMP,
+            PRIMARY KEY (model, prompt_hash, options_hash))"""
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS index_llm_cache_last_used ON llm_cache (last_used)"
+        )
+        self.connection.commit()
+        self.lock = threading.Lock()
+        self.hits = {}
+        self.misses = {}
+        self.updates = 0
+        self.evicted = 0
+
+    @staticmethod
+    def key(prompt: str, llm_string: str, client: Tuple[str, str] = None) -> tuple:
+        """
+        client is client_key() of the model making the call. Without it all we
+        have is the llm_string, which only identifies models that serialize
+        their settings into it. Calls whose model can't be told are not cached.
+        """
+        if client is None:
+            return model_name(llm_string), sha256(prompt), sha256(options_key(llm_string))
+        model, options = client
+        # The llm_string still carries call-time arguments, e.g. stop words.
+        return model, sha256(prompt), sha256(options + options_key(llm_string))
+
+    def lookup(
+        self, prompt: str, llm_string: str, client: Tuple[str, str] = None
+    ) -> Optional[Sequence[Generation]]:
+        key = self.key(prompt, llm_string, client)
+        if not key[0]:
+            # Can't tell which model this is, don't risk another model's answer.
+            return None
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT response FROM llm_cache WHERE model = ? AND prompt_hash = ? AND options_hash = ?",
+                key,
+            ).fetchone()
+            counter = self.hits if row is not None else self.misses
+            counter[key[0]] = counter.get(key[0], 0) + 1
+            if row is None:
+                return None
+            self.connection.execute(
+                "UPDATE llm_cache SET hits = hits + 1, last_used = ? WHERE model = ? AND prompt_hash = ? AND options_hash = ?",
+                (str(datetime.datetime.now()),) + key,
+            )
+            self.connection.commit()
+        try:
+            generations = [loads(generation) for generation in json.loads(row[0])]
+        except Exception:
+            # Written by an incompatible LangChain version, ask the model again.
+            return None
+        for generation in generations:
+            message = getattr(generation, "message", None)
+            if message is not None:
+                message.response_metadata[CACHED_METADATA_KEY] = True
+        return generations
+
+    def update(
+        self, prompt: str, llm_string: str, return_val: Sequence[Generation], client: Tuple[str, str] = None
+    ):
+        key = self.key(prompt, llm_string, client)
+        if not key[0]:
+            return
+        response = json.dumps([dumps(generation) for generation in return_val])
+        now = str(datetime.datetime.now())
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO llm_cache (model, prompt_hash, options_hash, response, size, hits, created, last_used) VALUES (?, ?, ?, ?, ?, 0, ?, ?)",
+                key + (response, len(response), now, now),
+            )
+            self.connection.commit()
+            self.updates += 1
+            if self.updates % EVICT_CHECK_INTERVAL == 1:
+                self.evict()
+
+    def evict(self) -> int:
+        """Drops least recently used entries until the cache is under max_bytes. Call with the lock held."""
+        total = self.connection.execute("SELECT coalesce(sum(size), 0) FROM llm_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+        # Evict down to 90% so we're not back here on the next insert.
+        target = total - int(self.max_bytes * 0.9)
+        cursor = self.connection.execute(
+            """DELETE FROM llm_cache WHERE rowid IN (
+                SELECT rowid FROM (
+                    SELECT rowid, coalesce(sum(size) OVER (
+                        ORDER BY last_used, rowid ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+                    ), 0) AS freed_before FROM llm_cache
+                ) WHERE freed_before < ?
+            )""",
+            (target,),
+        )
+        self.connection.commit()
+        self.evicted += cursor.rowcount
+        return cursor.rowcount
+
+    def clear(self, **kwargs):
+        with self.lock:
+            self.connection.execute("DELETE FROM llm_cache")
+            self.connection.commit()
+
+    def report(self) -> List[str]:
+        """Hit rates for this run, per model."""
+        lines = []
+        for model in sorted(set(self.hits) | set(self.misses)):
+            hits = self.hits.get(model, 0)
+            lookups = hits + self.misses.get(model, 0)
+            lines.append(f"LLM cache {model}: {hits} hits, {lookups - hits} misses ({hits / lookups:.1%} hit rate)")
+        if self.evicted:
+            lines.append(f"LLM cache: {self.evicted} entries evicted")
+        return lines or ["LLM cache: unused"]
+
+    def stats(self) -> List[str]:
+        """What's stored, per model, over all runs."""
+        lines = []
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT model, count(*), sum(size), sum(hits) FROM llm_cache GROUP BY model ORDER BY model"
+            ).fetchall()
+        for model, entries, size, hits in rows:
+            lines.append(f"{model}: {entries} responses, {size / 1048576:.1f}MB, {hits} hits")
+        lines.append(f"Limit: {self.max_bytes / 1048576:.0f}MB ({self.db_file})")
+        return lines
+
+
+def was_cached(message) -> bool:
+    """True if a chat model's answer came from the cache, not the model."""
+    return bool(getattr(message, "response_metadata", {}).get(CACHED_METADATA_KEY))
+
+
+class ClientCache(BaseCache):
+    """An LLMResponseCache as one chat model sees it, keyed on the model's own fields."""
+
+    def __init__(self, cache: LLMResponseCache, llm):
+        self.cache = cache
+        self.client = client_key(llm)
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[Sequence[Generation]]:
+        return self.cache.lookup(prompt, llm_string, self.client)
+
+    def update(self, prompt: str, llm_string: str, return_val: Sequence[Generation]):
+        self.cache.update(prompt, llm_string, return_val, self.client)
+
+    def clear(self, **kwargs):
+        self.cache.clear(**kwargs)
+
+
+def bind_llm_cache(llm):
+    """
+    Points llm at the global LLMResponseCache through a ClientCache. Leaves
+    models with a cache setting of their own (cache=False) alone.
+    """
+    cache = get_llm_cache()
+    if llm.cache is None and isinstance(cache, LLMResponseCache):
+        llm.cache = ClientCache(cache, llm)
+    return llm
+
+
+def check_keys() -> List[str]:
+    """
+    Problems with the keys of a few differently configured clients: they
+    should all be distinct, except for the same model on another host.
+    """
+    from langchain_ollama import ChatOllama
+
+    clients = {
+        "phi4": ChatOllama(model="phi4"),
+        "qwen2.5": ChatOllama(model="qwen2.5"),
+        "phi4 temperature=0.9": ChatOllama(model="phi4", temperature=0.9),
+        "phi4 num_ctx=8192": ChatOllama(model="phi4", num_ctx=8192),
+        "phi4 format=json": ChatOllama(model="phi4", format="json"),
+    }
+    keys = {}
+    problems = []
+    for name, llm in clients.items():
+        key = LLMResponseCache.key("prompt", llm._get_llm_string(), client_key(llm))
+        if key in keys:
+            problems.append(f"{name} has the same cache key as {keys[key]}")
+        keys.setdefault(key, name)
+    other_host = ChatOllama(model="phi4", base_url="http://other:11434")
+    if LLMResponseCache.key("prompt", other_host._get_llm_string(), client_key(other_host)) not in keys:
+        problems.append("phi4 on another host doesn't share phi4's cache key")
+    if client_key(clients["phi4"])[0] != "phi4":
+        problems.append("client_key() doesn't return the model name")
+    return problems
+
+
+def enable_llm_cache() -> Optional[LLMResponseCache]:
+    """Turns the cache on for every LangChain model in this process, unless llm_cache = False."""
+    if not getattr(config, "llm_cache", True):
+        return None
+    cache = LLMResponseCache()
+    set_llm_cache(cache)
+    return cache
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="LLM response cache stats.")
+    argparser.add_argument("--clear", action="store_true", help="Empty the cache")
+    argparser.add_argument("--check", action="store_true", help="Check that cache keys tell models apart")
+    args = argparser.parse_args()
+
+    if args.check:
+        problems = check_keys()
+        for line in problems or ["Cache keys OK."]:
+            print(line)
+        raise SystemExit(1 if problems else 0)
+
+    cache = LLMResponseCache()
+    if args.clear:
+        cache.clear()
+        cache.connection.execute("VACUUM")
+        print("LLM cache cleared.")
+    for line in cache.stats():
+        print(line)
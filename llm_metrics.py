@@ -0,0 +1,235 @@
+"""
+What it does:
+
+Records how long each LLM call took and where the time went, so we can tell
+if fact extraction is prompt-bound (long emails, prompt evaluation) or
+generation-bound (long answers), and how long the backlog has left.
+
+Ollama returns prompt_eval_count/prompt_eval_duration, eval_count/eval_duration,
+load_duration and total_duration with every chat response. 1.1 records them
+per call. The embedding client doesn't pass Ollama's numbers on, so 1.2 records
+the wall-clock time and an estimate of the input tokens.
+
+queue_seconds is the wall-clock time not spent inside Ollama: waiting for a
+free slot (OLLAMA_NUM_PARALLEL) and the network. Calls answered from the LLM
+cache (llm_cache.was_cached()) are recorded as cached and left out of the rates.
+
+Inputs:
+
+    llm_metrics_file  SQLite file for the metrics. Default <sqlite_dir>/llm_metrics.db
+    llm_metrics       Set to False in config.py to stop recording.
+
+    Run it directly for a summary of the last --hours (default 1) and an ETA
+    for what's left in the email DB. --clear empties the table.
+
+Outputs:
+
+    The llm_metrics table, and the summary.
+"""
+
+import argparse
+import os
+import socket
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+import config
+from email_store import PENDING_EMBEDDINGS_SQL, PENDING_FACTS_SQL, connect
+
+LLM_METRICS_FILE = getattr(config, "llm_metrics_file", f"{config.sqlite_dir}/llm_metrics.db")
+NANOSECONDS = 1e9
+
+_metrics = None
+
+
+class LLMMetrics:
+    """Per call metrics in a table of their own SQLite file. Safe to use from several threads."""
+
+    def __init__(self, db_file: str = LLM_METRICS_FILE):
+        self.db_file = db_file
+        self.worker = f"{socket.gethostname()}-{os.getpid()}"
+        self.connection = sqlite3.connect(db_file, timeout=60, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS llm_metrics (id INTEGER PRIMARY KEY AUTOINCREMENT,
+            stage TEXT, model TEXT, base_url TEXT, worker TEXT, started REAL, wall_seconds REAL,
+            queue_seconds REAL, load_seconds REAL, prompt_tokens INTEGER, prompt_seconds REAL,
+            eval_tokens INTEGER, eval_seconds REAL, cached INTEGER, items INTEGER DEFAULT 1)"""
+        )
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(llm_metrics)")]
+        if "items" not in columns:
+            self.connection.execute("ALTER TABLE llm_metrics ADD COLUMN items INTEGER DEFAULT 1")
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS index_llm_metrics_started ON llm_metrics (started)"
+        )
+        self.connection.commit()
+        self.lock = threading.Lock()
+
+    def record(
+        self,
+        stage: str,
+        model: str,
+        base_url: str,
+        started: float,
+        wall_seconds: float,
+        metadata: dict = None,
+        prompt_tokens: int = None,
+        items: int = 1,
+        cached: bool = False,
+    ):
+        """
+        Saves one call. metadata is the response_metadata of an Ollama chat
+        response, prompt_tokens an estimate for calls that don't have it.
+        items is how many messages the call covered, for batched prompts,
+        cached whether the answer came from the LLM cache.
+        """
+        # A cached answer comes back with the metadata of the call that made it,
+        # which says nothing about this one.
+        metadata = {} if cached else metadata or {}
+        total = metadata.get("total_duration")
+        values = (
+            stage,
+            model,
+            base_url,
+            self.worker,
+            started,
+            wall_seconds,
+            None if total is None else max(wall_seconds - total / NANOSECONDS, 0.0),
+            seconds(metadata.get("load_duration")),
+            metadata.get("prompt_eval_count", prompt_tokens),
+            seconds(metadata.get("prompt_eval_duration")),
+            metadata.get("eval_count"),
+            seconds(metadata.get("eval_duration")),
+            int(cached),
+            items,
+        )
+        with self.lock:
+            self.connection.execute(
+                """INSERT INTO llm_metrics (stage, model, base_url, worker, started, wall_seconds,
+                queue_seconds, load_seconds, prompt_tokens, prompt_seconds, eval_tokens, eval_seconds, cached, items)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                values,
+            )
+            self.connection.commit()
+
+    def clear(self):
+        with self.lock:
+            self.connection.execute("DELETE FROM llm_metrics")
+            self.connection.commit()
+
+    def summary(self, hours: float = 1.0, email_db: str = None) -> List[str]:
+        """Rates per stage, model and Ollama over the last `hours`, and an ETA per stage."""
+        since = time.time() - hours * 3600
+        lines = []
+        with self.lock:
+            rows = self.connection.execute(
+                """SELECT stage, model, base_url, count(*), sum(items), sum(cached),
+                sum(prompt_tokens), sum(prompt_seconds), sum(eval_tokens), sum(eval_seconds),
+                sum(load_seconds), avg(queue_seconds), avg(wall_seconds)
+                FROM llm_metrics WHERE started >= ? GROUP BY stage, model, base_url
+                ORDER BY stage, model, base_url""",
+                (since,),
+            ).fetchall()
+            spans = dict(
+                self.connection.execute(
+                    """SELECT stage, max(started + wall_seconds) - min(started) FROM llm_metrics
+                    WHERE started >= ? AND NOT cached GROUP BY stage""",
+                    (since,),
+                ).fetchall()
+            )
+            done = dict(
+                self.connection.execute(
+                    "SELECT stage, sum(items) FROM llm_metrics WHERE started >= ? AND NOT cached GROUP BY stage",
+                    (since,),
+                ).fetchall()
+            )
+        if not rows:
+            return [f"No LLM calls in the last {hours:g} hours."]
+
+        for (stage, model, base_url, calls, items, cached, prompt_tokens, prompt_seconds,
+             eval_tokens, eval_seconds, load_seconds, queue_wait, wall) in rows:
+            lines.append(
+                f"{stage} {model} @ {base_url}: {calls} calls for {items} messages ({cached} cached), {wall:.2f}s avg"
+            )
+            if prompt_seconds:
+                rates = f"  prompt {prompt_tokens} tokens at {prompt_tokens / prompt_seconds:.1f} tokens/s"
+                if eval_seconds:
+                    rates += f", generation {eval_tokens} tokens at {eval_tokens / eval_seconds:.1f} tokens/s"
+                lines.append(rates)
+                bound = "prompt-bound" if prompt_seconds > (eval_seconds or 0) else "generation-bound"
+                lines.append(
+                    f"  {prompt_seconds:.0f}s evaluating prompts, {eval_seconds or 0:.0f}s generating, "
+                    f"{load_seconds or 0:.0f}s loading the model: {bound}"
+                )
+            elif prompt_tokens:
+                lines.append(f"  ~{prompt_tokens} input tokens (estimated)")
+            if queue_wait is not None:
+                lines.append(f"  {queue_wait:.2f}s avg waiting outside Ollama (queue and network)")
+
+        backlog = pending_work(email_db)
+        for stage, pending in backlog.items():
+            rate = done.get(stage, 0) / spans[stage] if spans.get(stage) else 0
+            if not pending:
+                lines.append(f"{stage}: nothing left to do")
+            elif rate:
+                eta = format_duration(pending / rate)
+                lines.append(f"{stage}: {pending} left at {rate * 3600:.0f}/hour, about {eta} to go")
+            else:
+                lines.append(f"{stage}: {pending} left, no recent calls to estimate from")
+        return lines
+
+
+def seconds(nanoseconds: Optional[int]) -> Optional[float]:
+    return None if nanoseconds is None else nanoseconds / NANOSECONDS
+
+
+def format_duration(total_seconds: float) -> str:
+    hours, rest = divmod(int(total_seconds), 3600)
+    return f"{hours}h{rest // 60:02d}m"
+
+
+def pending_work(email_db: str = None) -> dict:
+    """Messages left for 1.1 and facts left for 1.2 in the email DB."""
+    email_db = email_db or config.sqlite_email_file
+    if not os.path.isfile(email_db):
+        return {}
+    connection = connect(email_db)
+    tables = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    backlog = {}
+    if "msgs" in tables and "email_facts" in tables:
+        backlog["facts"] = connection.execute(f"SELECT count(*) {PENDING_FACTS_SQL}").fetchone()[0]
+    if "email_facts" in tables and "email_embedded" in tables:
+        backlog["embed"] = connection.execute(f"SELECT count(*) {PENDING_EMBEDDINGS_SQL}").fetchone()[0]
+    connection.close()
+    return backlog
+
+
+def enable_llm_metrics() -> Optional[LLMMetrics]:
+    """Starts recording for this process, unless llm_metrics = False."""
+    global _metrics
+    if getattr(config, "llm_metrics", True):
+        _metrics = LLMMetrics()
+    return _metrics
+
+
+def record_llm_call(*args, **kwargs):
+    """LLMMetrics.record() if enable_llm_metrics() was called, otherwise nothing."""
+    if _metrics is not None:
+        _metrics.record(*args, **kwargs)
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="LLM throughput summary.")
+    argparser.add_argument("--hours", type=float, default=1.0, help="Summarize the last N hours")
+    argparser.add_argument("--clear", action="store_true", help="Empty the metrics table")
+    args = argparser.parse_args()
+
+    metrics = LLMMetrics()
+    if args.clear:
+        metrics.clear()
+        print("LLM metrics cleared.")
+    else:
+        for line in metrics.summary(hours=args.hours):
+            print(line)
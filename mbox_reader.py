@@ -0,0 +1,261 @@
+"""
+What it does:
+
+A streaming reader for mbox files built on mmap. It finds messages by
+scanning for "From " lines, the same way mailbox.mbox does, but doesn't
+build a table of contents up front or parse anything it isn't asked for.
+
+The message byte ranges are saved to a sidecar index (<mbox file>.idx) the
+first time the whole file is scanned. Later runs, and other tools, can use
+it to jump straight to message N without rescanning.
+
+Sidecar layout (all little-endian uint64):
+
+    magic (8 bytes) | mbox size | mbox mtime_ns | message count | (start, stop) * count
+
+Entry N lives at INDEX_HEADER.size + N * INDEX_ENTRY.size, so read_index_entry()
+can seek to it directly.
+"""
+
+import hashlib
+import mailbox
+import mmap
+import os
+import re
+import struct
+from typing import Iterator, List, Optional, Tuple
+
+INDEX_SUFFIX = ".idx"
+INDEX_MAGIC = b"MBXIDX1\0"
+INDEX_HEADER = struct.Struct("<8sQQQ")
+INDEX_ENTRY = struct.Struct("<QQ")
+# Bytes hashed at the start of the file and before a high-water mark by fingerprint()
+FINGERPRINT_WINDOW = 65536
+# The blank line that ends the header block
+HEADER_END = re.compile(rb"\n\r?\n")
+
+
+def index_path(mbox_file: str) -> str:
+    return f"{mbox_file}{INDEX_SUFFIX}"
+
+
+def scan_offsets(buffer, start: int = 0) -> Iterator[Tuple[int, int]]:
+    """
+    Yields the (start, stop) byte range of every message in an mbox buffer.
+
+    Mirrors mailbox.mbox._generate_toc(): a message starts at a line beginning
+    with "From ", and a blank line right before the next one isn't part of it.
+
+    Args:
+        buffer: An mmap (or bytes) of the mbox file.
+        start (int): Where to start scanning. Must be the start of a line.
+
+    Yields:
+        tuple: (start, stop) offsets of a message, "From " line included.
+    """
+    linesep = mailbox.linesep
+    size = len(buffer)
+
+    if buffer[start : start + 5] == b"From ":
+        msg_start = start
+    else:
+        msg_start = buffer.find(b"\nFrom ", start)
+        if msg_start == -1:
+            return
+        msg_start += 1
+
+    while True:
+        next_start = buffer.find(b"\nFrom ", msg_start)
+        if next_start == -1:
+            break
+        next_start += 1
+        if buffer[next_start - len(linesep) - 1 : next_start] == b"\n" + linesep:
+            yield msg_start, next_start - len(linesep)
+        else:
+            yield msg_start, next_start
+        msg_start = next_start
+
+    if size - msg_start > len(linesep) and buffer[size - len(linesep) - 1 : size] == b"\n" + linesep:
+        yield msg_start, size - len(linesep)
+    else:
+        yield msg_start, size
+
+
+def from_line(raw_message: bytes) -> str:
+    """The "From " line of a raw message, as mboxMessage.get_from() would return it."""
+    first_line = raw_message.partition(b"\n")[0]
+    return (first_line + b"\n").replace(mailbox.linesep, b"")[5:].decode("ascii")
+
+
+def message_from_bytes(raw_message: bytes) -> mailbox.mboxMessage:
+    """Builds the same mboxMessage mailbox.mbox would from one message's bytes."""
+    body = raw_message.partition(b"\n")[2]
+    message = mailbox.mboxMessage(body.replace(mailbox.linesep, b"\n"))
+    message.set_from(from_line(raw_message))
+    return message
+
+
+def header_block(raw_message: bytes) -> bytes:
+    """
+    The "From " line and headers of a raw message, without the body. Parsing
+    this with message_from_bytes() gives the same headers as the whole message
+    at a fraction of the cost, which is all the skip rules need.
+    """
+    match = HEADER_END.search(raw_message)
+    if match is None:
+        return raw_message
+    return raw_message[: match.start() + 1]
+
+
+def _fingerprint(mbox_file: str) -> Tuple[int, int]:
+    stat = os.stat(mbox_file)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def load_index(mbox_file: str) -> Optional[List[Tuple[int, int]]]:
+    """Returns the saved offsets for mbox_file, or None if there's no usable index."""
+    try:
+        with open(index_path(mbox_file), "rb") as index_file:
+            magic, size, mtime_ns, count = INDEX_HEADER.unpack(
+                index_file.read(INDEX_HEADER.size)
+            )
+            if magic != INDEX_MAGIC or (size, mtime_ns) != _fingerprint(mbox_file):
+                return None
+            data = index_file.read(count * INDEX_ENTRY.size)
+    except (OSError, struct.error):
+        return None
+    if len(data) != count * INDEX_ENTRY.size:
+        return None
+    return list(INDEX_ENTRY.iter_unpack(data))
+
+
+def save_index(mbox_file: str, offsets: List[Tuple[int, int]]) -> bool:
+    size, mtime_ns = _fingerprint(mbox_file)
+    tmp_file = f"{index_path(mbox_file)}.tmp"
+    try:
+        with open(tmp_file, "wb") as index_file:
+            index_file.write(INDEX_HEADER.pack(INDEX_MAGIC, size, mtime_ns, len(offsets)))
+            for entry in offsets:
+                index_file.write(INDEX_ENTRY.pack(*entry))
+        os.replace(tmp_file, index_path(mbox_file))
+    except OSError as e:
+        # Read-only data dirs are fine, we just rescan next time.
+        print(f"Unable to save mbox index: {e}")
+        return False
+    return True
+
+
+def read_index_entry(mbox_file: str, number: int) -> Optional[Tuple[int, int]]:
+    """
+    Looks up the byte range of message `number` without loading the whole index.
+
+    Returns:
+        tuple: (start, stop) offsets, or None if the index is missing, stale or too short.
+    """
+    try:
+        with open(index_path(mbox_file), "rb") as index_file:
+            magic, size, mtime_ns, count = INDEX_HEADER.unpack(
+                index_file.read(INDEX_HEADER.size)
+            )
+            if magic != INDEX_MAGIC or (size, mtime_ns) != _fingerprint(mbox_file):
+                return None
+            if not 0 <= number < count:
+                return None
+            index_file.seek(INDEX_HEADER.size + number * INDEX_ENTRY.size)
+            return INDEX_ENTRY.unpack(index_file.read(INDEX_ENTRY.size))
+    except (OSError, struct.error):
+        return None
+
+
+class MboxReader:
+    """
+    Lazily reads raw messages from an mbox file through mmap.
+
+    Iterating yields each message's bytes as the file is scanned. A full scan
+    saves the sidecar index, which later opens pick up automatically.
+    """
+
+    def __init__(self, mbox_file: str, use_index: bool = True):
+        self.mbox_file = mbox_file
+        self.use_index = use_index
+        self._file = open(mbox_file, "rb")
+        if os.fstat(self._file.fileno()).st_size:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            # mmap refuses empty files
+            self._mmap = b""
+        self._offsets = load_index(mbox_file) if use_index else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if isinstance(self._mmap, mmap.mmap):
+            self._mmap.close()
+        self._file.close()
+
+    @property
+    def size(self) -> int:
+        return len(self._mmap)
+
+    def fingerprint(self, offset: int) -> str:
+        """
+        Hashes the start of the file and the bytes just before offset. If an
+        mbox has only been appended to, the fingerprint at an old offset is unchanged.
+        """
+        offset = min(offset, self.size)
+        digest = hashlib.sha256()
+        digest.update(self._mmap[: min(FINGERPRINT_WINDOW, offset)])
+        digest.update(self._mmap[max(0, offset - FINGERPRINT_WINDOW) : offset])
+        return digest.hexdigest()
+
+    def iter_offsets(self, start: int = 0) -> Iterator[Tuple[int, int]]:
+        """
+        Yields (start, stop) for each message starting at or after start.
+        Only a full scan from 0 is saved to the index.
+        """
+        if self._offsets is not None:
+            for entry in self._offsets:
+                if entry[0] >= start:
+                    yield entry
+            return
+        if start:
+            yield from scan_offsets(self._mmap, start)
+            return
+        offsets = []
+        for entry in scan_offsets(self._mmap):
+            offsets.append(entry)
+            yield entry
+        self._offsets = offsets
+        if self.use_index:
+            save_index(self.mbox_file, offsets)
+
+    def __iter__(self) -> Iterator[bytes]:
+        for start, stop in self.iter_offsets():
+            yield self._mmap[start:stop]
+
+    def __len__(self) -> int:
+        if self._offsets is None:
+            for _ in self.iter_offsets():
+                pass
+        return len(self._offsets)
+
+    def get_bytes(self, number: int) -> bytes:
+        if self._offsets is None:
+            entry = read_index_entry(self.mbox_file, number) if self.use_index else None
+            if entry is None:
+                len(self)
+                entry = self._offsets[number]
+        else:
+            entry = self._offsets[number]
+        start, stop = entry
+        return self._mmap[start:stop]
+
+    def get_range(self, start: int, stop: int) -> bytes:
+        return self._mmap[start:stop]
+
+    def get_message(self, number: int) -> mailbox.mboxMessage:
+        return message_from_bytes(self.get_bytes(number))
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+What it does:
+
+Converts the payload and headers columns of msgs and raw_msgs in an existing
+email DB to another storage codec. Use it after turning on
+email_payload_compression in config.py, or with --codec none to undo it.
+Rows already stored with the target codec are left alone, so it can be
+stopped and re-run.
+
+Inputs:
+
+    --codec     zlib, zstd or none. Defaults to email_payload_compression.
+    --batch-size  Rows converted per transaction.
+    --vacuum    Run VACUUM at the end so the file actually shrinks.
+
+Outputs:
+
+    The same DB, with the columns re-encoded, and the size before and after.
+"""
+
+import argparse
+import errno
+import os
+import sqlite3
+import sys
+
+from rich.console import Console
+
+import config
+from email_store import (
+    MIN_COMPRESS_SIZE,
+    ZSTD_MAGIC,
+    compress_text,
+    connect,
+    decompress_text,
+    payload_codec,
+    zstandard,
+)
+
+
+def needs_conversion(value, codec: str) -> bool:
+    if not isinstance(value, bytes):
+        return codec is not None and value is not None and len(value) >= MIN_COMPRESS_SIZE
+    return codec != ("zstd" if value.startswith(ZSTD_MAGIC) else "zlib")
+
+
+def convert_table(
+    table_name: str, codec: str, batch_size: int, connection: sqlite3.Connection
+) -> int:
+    converted = 0
+    last_id = 0
+    cursor = connection.cursor()
+    while True:
+        rows = cursor.execute(
+            f"SELECT id, payload, headers FROM {table_name} WHERE id > ? ORDER BY id LIMIT ?",
+            (last_id, batch_size),
+        ).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        updates = []
+        for row_id, payload, headers in rows:
+            if not needs_conversion(payload, codec) and not needs_conversion(headers, codec):
+                continue
+            updates.append(
+                (
+                    compress_text(decompress_text(payload), codec),
+                    compress_text(decompress_text(headers), codec),
+                    row_id,
+                )
+            )
+        cursor.executemany(
+            f"UPDATE {table_name} SET payload = ?, headers = ? WHERE id = ?", updates
+        )
+        connection.commit()
+        converted += len(updates)
+        sys.stdout.write("%s: %d rows converted   \r" % (table_name, converted))
+        sys.stdout.flush()
+    cursor.close()
+    print()
+    return converted
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(
+        description="Compress or decompress email payloads in sqlite."
+    )
+    argparser.add_argument(
+        "--codec", choices=["zlib", "zstd", "none"], help="Codec to convert to"
+    )
+    argparser.add_argument("--batch-size", type=int, default=1000)
+    argparser.add_argument(
+        "--vacuum", action="store_true", help="VACUUM the DB afterwards"
+    )
+    args = argparser.parse_args()
+
+    if not os.path.isfile(config.sqlite_email_file):
+        print(f"{config.sqlite_email_file} not found")
+        sys.exit(errno.EINVAL)
+
+    if args.codec is None:
+        codec = payload_codec()
+    elif args.codec == "none":
+        codec = None
+    else:
+        codec = args.codec
+    if codec == "zstd" and zstandard is None:
+        print("zstandard isn't installed. pip install zstandard")
+        sys.exit(1)
+
+    console = Console()
+    size_before = os.path.getsize(config.sqlite_email_file)
+
+    connection = connect(config.sqlite_email_file)
+    for table_name in ["msgs", "raw_msgs"]:
+        converted = convert_table(
+            table_name=table_name,
+            codec=codec,
+            batch_size=args.batch_size,
+            connection=connection,
+        )
+        console.print(f"{table_name}: {converted} rows stored as {codec or 'text'}")
+
+    if args.vacuum:
+        with console.status("Vacuuming..."):
+            connection.execute("VACUUM")
+    connection.close()
+
+    size_after = os.path.getsize(config.sqlite_email_file)
+    console.print(
+        f"DB size: {size_before / 1048576:.1f}MB -> {size_after / 1048576:.1f}MB"
+    )
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+What it does:
+
+Sets up SQLite FTS5 full-text indexes over the email DB so emails and facts
+can be found by keyword without the LLM or Qdrant. msgs_fts covers
+msgs.subject and msgs.payload, email_facts_fts covers email_facts.facts.
+Triggers keep both in sync as 1.0 and 1.1 add rows, so this only has to be
+run once (or with --rebuild if the index is ever in doubt).
+
+Inputs:
+
+    --rebuild       Drop and re-create the indexes from scratch.
+    --drop          Remove the indexes and their triggers.
+    --search QUERY  Keyword search the indexes and print the best matches.
+    --limit N       Results per table for --search. Default 10.
+    --raw           Take the --search QUERY as FTS5 syntax (AND, OR, NOT, NEAR,
+                    "phrases") instead of plain words.
+
+Outputs:
+
+    The FTS tables and triggers in the email DB, or search results.
+"""
+
+import argparse
+import errno
+import os
+import sqlite3
+import sys
+import time
+
+from rich.console import Console
+
+import config
+from email_store import (
+    connect,
+    create_fts,
+    drop_fts,
+    fts_enabled,
+    search_emails,
+    search_facts,
+)
+from utilities import table_exists
+
+
+def snippet(text: str, length: int = 200) -> str:
+    text = " ".join((text or "").split())
+    return text if len(text) <= length else text[:length] + "..."
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(
+        description="Full-text index the email DB with SQLite FTS5."
+    )
+    argparser.add_argument("--rebuild", action="store_true", help="Re-create the indexes")
+    argparser.add_argument("--drop", action="store_true", help="Remove the indexes")
+    argparser.add_argument("--search", metavar="QUERY", help="Keyword search")
+    argparser.add_argument("--limit", type=int, default=10, help="Results per table")
+    argparser.add_argument("--raw", action="store_true", help="QUERY is FTS5 syntax, not plain words")
+    args = argparser.parse_args()
+
+    if not os.path.isfile(config.sqlite_email_file):
+        print(f"{config.sqlite_email_file} not found")
+        sys.exit(errno.EINVAL)
+
+    console = Console()
+    connection = connect(config.sqlite_email_file)
+
+    if not table_exists(connection=connection, table_name="msgs"):
+        print("No msgs table, run 1.0-email-load_into_sqlite.py first.")
+        sys.exit(errno.EINVAL)
+    if not table_exists(connection=connection, table_name="email_facts"):
+        # The triggers need the table to exist. 1.1 would create the same one.
+        connection.execute(
+            "CREATE TABLE email_facts (fact_hash TEXT UNIQUE, fact_date TIMESTAMP, msg_from TIMESTAMP, facts TEXT)"
+        )
+        connection.execute("CREATE INDEX index_fact_hash ON email_facts (fact_hash);")
+        connection.commit()
+
+    if args.drop or args.rebuild:
+        drop_fts(connection)
+        console.print("Full-text indexes removed.")
+
+    if not args.drop and (args.rebuild or not fts_enabled(connection)):
+        start = time.time()
+        with console.status("Indexing emails and facts..."):
+            msgs_indexed, facts_indexed = create_fts(connection)
+        console.print(
+            f"Indexed {msgs_indexed} emails and {facts_indexed} facts in {time.time() - start:.1f}s"
+        )
+
+    if args.search:
+        if not fts_enabled(connection):
+            print("No full-text index. Run without --drop first.")
+            sys.exit(1)
+        start = time.time()
+        try:
+            emails = search_emails(connection, args.search, limit=args.limit, raw=args.raw)
+            facts = search_facts(connection, args.search, limit=args.limit, raw=args.raw)
+        except sqlite3.OperationalError as e:
+            print(f"Bad FTS5 query {args.search!r}: {e}")
+            sys.exit(errno.EINVAL)
+        elapsed = (time.time() - start) * 1000
+
+        console.print(f"[bold]Emails ({len(emails)})")
+        for msg in emails:
+            console.print(f"[dodger_blue2]{msg.msg_date} {msg.sender} - {msg.subject}")
+            console.print(f"  {snippet(msg.payload)}", markup=False)
+        console.print(f"[bold]Facts ({len(facts)})")
+        for _, fact_date, _, facts_text in facts:
+            console.print(f"[dodger_blue2]{fact_date}")
+            console.print(f"  {snippet(facts_text)}", markup=False)
+        console.print(f"Search took {elapsed:.1f}ms")
+
+    connection.close()
@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+"""
+What it does:
+
+A stand-in for Ollama and Qdrant, so the pipeline can be benchmarked and
+regression tested without GPUs or a vector DB. Standard library only.
+
+One port serves both APIs, the parts this project uses:
+
+    Ollama  POST /api/chat, /api/generate, /api/embed, /api/embeddings
+            GET /api/tags, /api/version, POST /api/show
+    Qdrant  GET/PUT/DELETE /collections/{name}, GET /collections,
+            PUT /collections/{name}/points, POST .../points/search,
+            .../points/query, .../points/scroll, .../points/count
+
+Answers are deterministic, worked out from a hash of the prompt:
+
+    - Prompts asking for JSON (the 1.1 fact prompt) get a canned facts object,
+      about a third of them empty, like a real model on dull email. Batch
+      prompts get one per email, keyed by the email ids.
+    - "True or False" prompts get True or False.
+    - Anything else gets a short sentence.
+    - Embeddings are unit vectors seeded from the text, so the same text always
+      gets the same vector and search results don't change between runs.
+
+Chat responses carry Ollama's prompt_eval_count, eval_count and durations,
+counted at about 4 characters a token. With --prompt-tps/--eval-tps the
+server also takes that long to answer, and --parallel limits how many chats
+run at once like OLLAMA_NUM_PARALLEL, so queueing shows up in llm_metrics.py.
+Qdrant collections live in memory and are gone when the server stops.
+
+Inputs:
+
+    --port N          Default 11500. Point llm_url and qdrant_url at it.
+    --latency S       Seconds added to every request. Default 0.
+    --prompt-tps N    Simulated prompt evaluation tokens/s. 0 (default) is instant.
+    --eval-tps N      Simulated generation tokens/s. 0 (default) is instant.
+    --parallel N      Chat requests served at once. Default 1.
+    --dimensions N    Embedding size. Default 768, like nomic-embed-text.
+
+Outputs:
+
+    Request counts per endpoint when it's stopped with Ctrl-C.
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+# Characters per token, same estimate as utilities.CHARS_PER_TOKEN.
+CHARS_PER_TOKEN = 4
+FACT_TYPES = ["Interest", "Hobby", "Preference", "PersonalDetail", "Characteristic", "Value"]
+QDRANT_VERSION = "1.12.0"
+OLLAMA_VERSION = "0.5.7"
+# The per-email delimiters of 1.1's batch prompt.
+EMAIL_BLOCK = re.compile(r"^=== Email (\S+) ===$(.*?)^=== End of email \1 ===$", re.MULTILINE | re.DOTALL)
+
+
+def digest(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8", errors="surrogateescape")).digest()
+
+
+def tokens(text: str) -> int:
+    return max(1, (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN)
+
+
+def stub_vector(text: str, dimensions: int) -> list:
+    generator = random.Random(int.from_bytes(digest(text)[:8], "big"))
+    vector = [generator.gauss(0.0, 1.0) for _ in range(dimensions)]
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+
+def stub_facts(prompt: str) -> dict:
+    """Zero to two facts, picked by the prompt's hash."""
+    hashed = digest(prompt)
+    date = re.search(r"^Date: (.*)$", prompt, re.MULTILINE)
+    facts = {}
+    for number in range(hashed[0] % 3):
+        fact_type = FACT_TYPES[hashed[number + 1] % len(FACT_TYPES)]
+        facts.setdefault(fact_type, []).append(
+            {
+                "fact": f"Stub {fact_type.lower()} {hashed[number + 1:number + 5].hex()}",
+                "source": "body",
+                "date": date.group(1).strip() if date else "",
+            }
+        )
+    return facts
+
+
+def stub_answer(prompt: str) -> str:
+    emails = EMAIL_BLOCK.findall(prompt)
+    if emails:
+        # A 1.1 batch prompt, answered keyed by email id.
+        return json.dumps({email_id: stub_facts(email) for email_id, email in emails})
+    if "JSON" in prompt:
+        return json.dumps(stub_facts(prompt))
+    if "True or False" in prompt:
+        return "True" if digest(prompt)[0] % 2 else "False"
+    return f"Stub answer {digest(prompt)[:4].hex()}."
+
+
+def cosine(a: list, b: list) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norms = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norms if norms else 0.0
+
+
+class StubState:
+    """Everything the handlers share: options, Qdrant collections and request counts."""
+
+    def __init__(self, latency=0.0, prompt_tps=0.0, eval_tps=0.0, parallel=1, dimensions=768):
+        self.latency = latency
+        self.prompt_tps = prompt_tps
+        self.eval_tps = eval_tps
+        self.dimensions = dimensions
+        self.chat_slots = threading.Semaphore(parallel)
+        self.lock = threading.Lock()
+        self.collections = {}
+        self.operation_id = 0
+        self.requests = Counter()
+        self.models = set()
+
+    def count(self, endpoint: str):
+        with self.lock:
+            self.requests[endpoint] += 1
+
+    def generate(self, model: str, prompt: str) -> dict:
+        """Runs a chat or generate request, returns the answer and Ollama's timing fields."""
+        self.models.add(model)
+        answer = stub_answer(prompt)
+        prompt_tokens, eval_tokens = tokens(prompt), tokens(answer)
+        prompt_seconds = prompt_tokens / self.prompt_tps if self.prompt_tps else 0.0
+        eval_seconds = eval_tokens / self.eval_tps if self.eval_tps else 0.0
+        # total_duration starts once a slot is free, like Ollama's. The wait
+        # before that is what llm_metrics.py calls queue time.
+        with self.chat_slots:
+            start = time.perf_counter()
+            time.sleep(prompt_seconds + eval_seconds)
+            total = time.perf_counter() - start
+        return {
+            "answer": answer,
+            "total_duration": int(total * 1e9),
+            "load_duration": 0,
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": max(int(prompt_seconds * 1e9), 1),
+            "eval_count": eval_tokens,
+            "eval_duration": max(int(eval_seconds * 1e9), 1),
+        }
+
+    def embed(self, model: str, texts: list) -> dict:
+        self.models.add(model)
+        start = time.perf_counter()
+        embeddings = [stub_vector(text, self.dimensions) for text in texts]
+        return {
+            "model": model,
+            "embeddings": embeddings,
+            "total_duration": int((time.perf_counter() - start) * 1e9),
+            "load_duration": 0,
+            "prompt_eval_count": sum(tokens(text) for text in texts),
+        }
+
+    def upsert(self, name: str, body: dict) -> int:
+        if "batch" in body:
+            batch = body["batch"]
+            payloads = batch.get("payloads") or [None] * len(batch["ids"])
+            points = [
+                {"id": point_id, "vector": vector, "payload": payload}
+                for point_id, vector, payload in zip(batch["ids"], batch["vectors"], payloads)
+            ]
+        else:
+            points = body["points"]
+        with self.lock:
+            collection = self.collections[name]
+            for point in points:
+                collection["points"][point["id"]] = (point["vector"], point.get("payload") or {})
+            self.operation_id += 1
+            return self.operation_id
+
+    def search(self, name: str, vector, limit: int, offset: int = 0, with_payload=True, threshold=None) -> list:
+        if isinstance(vector, dict):
+            vector = vector.get("vector", vector.get("nearest"))
+        with self.lock:
+            points = list(self.collections[name]["points"].items())
+        scored = sorted(
+            ((cosine(vector, point_vector), point_id, payload) for point_id, (point_vector, payload) in points),
+            key=lambda item: item[0],
+            reverse=True,
+        )
+        if threshold is not None:
+            scored = [item for item in scored if item[0] >= threshold]
+        return [
+            {"id": point_id, "version": 0, "score": score, "payload": payload if with_payload else None, "vector": None}
+            for score, point_id, payload in scored[offset:offset + limit]
+        ]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state: StubState = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def send(self, status: int, body, content_type: str = "application/json"):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def qdrant(self, result, status: int = 200):
+        self.send(status, {"result": result, "status": "ok", "time": 0.0})
+
+    def qdrant_error(self, status: int, message: str):
+        self.send(status, {"status": {"error": message}, "time": 0.0})
+
+    def handle_request(self, method: str):
+        path = urlparse(self.path).path.rstrip("/") or "/"
+        body = self.read_body() if method in ("POST", "PUT") else {}
+        if self.state.latency:
+            time.sleep(self.state.latency)
+        parts = path.strip("/").split("/")
+        if parts[0] == "api":
+            self.state.count(path)
+            return self.ollama(method, path, body)
+        if parts[0] == "collections":
+            endpoint = "/".join(["collections"] + (["{name}"] if len(parts) > 1 else []) + parts[2:])
+            self.state.count(f"{method} /{endpoint}")
+            return self.qdrant_collections(method, parts[1:], body)
+        if path == "/":
+            self.state.count("/")
+            return self.send(200, {"title": "qdrant - vector search engine (stub)", "version": QDRANT_VERSION})
+        self.send(404, {"error": f"{method} {path} not found"})
+
+    def ollama(self, method: str, path: str, body: dict):
+        state = self.state
+        if path == "/api/version":
+            return self.send(200, {"version": OLLAMA_VERSION})
+        if path == "/api/tags":
+            models = [{"name": model, "model": model, "size": 0, "digest": "stub"} for model in sorted(state.models)]
+            return self.send(200, {"models": models})
+        if path == "/api/show":
+            return self.send(200, {"modelfile": "", "parameters": "", "template": "", "details": {"family": "stub"},
+                                   "model_info": {}, "capabilities": ["completion", "tools"]})
+        if path in ("/api/chat", "/api/generate"):
+            model = body.get("model", "")
+            if path == "/api/chat":
+                prompt = "\n".join(str(message.get("content", "")) for message in body.get("messages", []))
+            else:
+                prompt = body.get("prompt", "")
+            result = state.generate(model, prompt)
+            answer = result.pop("answer")
+            created = time.strftime("%Y-%m-%dT%H:%M:%S.000000Z", time.gmtime())
+
+            def chunk(text: str, done: bool) -> dict:
+                part = {"model": model, "created_at": created, "done": done}
+                if path == "/api/chat":
+                    part["message"] = {"role": "assistant", "content": text}
+                else:
+                    part["response"] = text
+                return part
+
+            final = dict(chunk("" if body.get("stream", True) else answer, True), done_reason="stop", **result)
+            if not body.get("stream", True):
+                return self.send(200, final)
+            # Streamed as NDJSON, a few words per line like the real thing.
+            words = re.findall(r"\S+\s*", answer) or [""]
+            lines = [chunk("".join(words[i:i + 8]), False) for i in range(0, len(words), 8)]
+            data = "".join(json.dumps(line) + "\n" for line in lines + [final]).encode("utf-8")
+            return self.send(200, data, "application/x-ndjson")
+        if path == "/api/embed":
+            texts = body.get("input", [])
+            return self.send(200, state.embed(body.get("model", ""), [texts] if isinstance(texts, str) else texts))
+        if path == "/api/embeddings":
+            result = state.embed(body.get("model", ""), [body.get("prompt", "")])
+            return self.send(200, {"embedding": result["embeddings"][0]})
+        self.send(404, {"error": f"{method} {path} not found"})
+
+    def qdrant_collections(self, method: str, parts: list, body: dict):
+        state = self.state
+        if not parts:
+            with state.lock:
+                names = [{"name": name} for name in sorted(state.collections)]
+            return self.qdrant({"collections": names})
+        name, action = parts[0], "/".join(parts[1:])
+        collection = state.collections.get(name)
+        if method == "PUT" and not action:
+            if collection is not None:
+                return self.qdrant_error(409, f"Wrong input: Collection `{name}` already exists!")
+            vectors = body.get("vectors", {"size": state.dimensions, "distance": "Cosine"})
+            with state.lock:
+                state.collections[name] = {"vectors": vectors, "points": {}}
+            return self.qdrant(True)
+        if method == "DELETE" and not action:
+            with state.lock:
+                existed = state.collections.pop(name, None) is not None
+            return self.qdrant(existed)
+        if action == "exists":
+            return self.qdrant({"exists": collection is not None})
+        if collection is None:
+            return self.qdrant_error(404, f"Not found: Collection `{name}` doesn't exist!")
+        if method == "GET" and not action:
+            count = len(collection["points"])
+            return self.qdrant(
+                {
+                    "status": "green",
+                    "optimizer_status": "ok",
+                    "vectors_count": count,
+                    "indexed_vectors_count": 0,
+                    "points_count": count,
+                    "segments_count": 1,
+                    "config": {
+                        "params": {"vectors": collection["vectors"], "shard_number": 1,
+                                   "replication_factor": 1, "write_consistency_factor": 1,
+                                   "on_disk_payload": True},
+                        "hnsw_config": {"m": 16, "ef_construct": 100, "full_scan_threshold": 10000,
+                                        "max_indexing_threads": 0, "on_disk": False},
+                        "optimizer_config": {"deleted_threshold": 0.2, "vacuum_min_vector_number": 1000,
+                                             "default_segment_number": 0, "max_segment_size": None,
+                                             "memmap_threshold": None, "indexing_threshold": 20000,
+                                             "flush_interval_sec": 5, "max_optimization_threads": None},
+                        "wal_config": {"wal_capacity_mb": 32, "wal_segments_ahead": 0},
+                        "quantization_config": None,
+                    },
+                    "payload_schema": {},
+                }
+            )
+        if method == "PUT" and action == "points":
+            operation_id = state.upsert(name, body)
+            return self.qdrant({"operation_id": operation_id, "status": "completed"})
+        if action == "points/search":
+            return self.qdrant(
+                state.search(name, body["vector"], body.get("limit", 10), body.get("offset", 0),
+                             body.get("with_payload", False), body.get("score_threshold"))
+            )
+        if action == "points/query":
+            points = []
+            if body.get("query") is not None:
+                points = state.search(name, body["query"], body.get("limit", 10), body.get("offset", 0),
+                                      body.get("with_payload", False), body.get("score_threshold"))
+            return self.qdrant({"points": points})
+        if action == "points/scroll":
+            with state.lock:
+                items = list(collection["points"].items())
+            limit = body.get("limit", 10)
+            start = int(body.get("offset") or 0)
+            page = [
+                {"id": point_id, "payload": payload if body.get("with_payload", True) else None, "vector": None}
+                for point_id, (_, payload) in items[start:start + limit]
+            ]
+            next_offset = start + limit if start + limit < len(items) else None
+            return self.qdrant({"points": page, "next_page_offset": next_offset})
+        if action == "points/count":
+            return self.qdrant({"count": len(collection["points"])})
+        self.qdrant_error(404, f"{method} /collections/{name}/{action} isn't stubbed")
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_PUT(self):
+        self.handle_request("PUT")
+
+    def do_DELETE(self):
+        self.handle_request("DELETE")
+
+
+def make_server(port: int = 11500, host: str = "127.0.0.1", **options) -> ThreadingHTTPServer:
+    """A stub server, not started yet. options go to StubState. Port 0 picks a free one."""
+    handler = type("Handler", (StubHandler,), {"state": StubState(**options)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Stub Ollama and Qdrant server.")
+    argparser.add_argument("--port", type=int, default=11500, help="Port for both APIs")
+    argparser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    argparser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every request")
+    argparser.add_argument("--prompt-tps", type=float, default=0.0, help="Simulated prompt tokens/s")
+    argparser.add_argument("--eval-tps", type=float, default=0.0, help="Simulated generation tokens/s")
+    argparser.add_argument("--parallel", type=int, default=1, help="Chat requests served at once")
+    argparser.add_argument("--dimensions", type=int, default=768, help="Embedding size")
+    args = argparser.parse_args()
+
+    server = make_server(
+        port=args.port,
+        host=args.host,
+        latency=args.latency,
+        prompt_tps=args.prompt_tps,
+        eval_tps=args.eval_tps,
+        parallel=args.parallel,
+        dimensions=args.dimensions,
+    )
+    print(f"Stub Ollama and Qdrant on http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    for endpoint, count in sorted(server.RequestHandlerClass.state.requests.items()):
+        print(f"{count:8d}  {endpoint}")
@@ -1,11 +1,60 @@
-import sys
+#!/usr/bin/env python3
+"""
+What it does:
+
+Puts display names on the addresses in msgs, so the sender and receiver
+columns read "Name <address>" instead of just the address. The names come
+from address_book, with your own addresses named from config.emails_dict.
+
+msgs gets sender_norm/receiver_norm columns (lowercased bare addresses) the
+first time it runs. Everything else is a few UPDATE...FROM joins on those
+columns in one transaction, so it's quick and can be re-run at any time.
+
+Inputs:
+
+    The email DB (config.sqlite_email_file) and config.emails_dict.
+
+Outputs:
+
+    Updated address_book.display_name and msgs.sender/receiver, and the number
+    of rows changed.
+"""
+
+import email.utils
 import sqlite3
+import sys
 import os
+import time
 
 from rich import print
 from rich.console import Console
 
 import config
+from utilities import normalize_address
+
+
+def address_key(value: str) -> str:
+    """The normalized bare address in "Name <addr>" or "addr"."""
+    if value is None:
+        return None
+    return normalize_address(email.utils.parseaddr(value)[1] or value)
+
+
+def add_norm_columns(connection: sqlite3.Connection, table_name: str):
+    """Adds and fills sender_norm/receiver_norm. Rows added since the last run are filled in too."""
+    cursor = connection.cursor()
+    columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table_name})")]
+    for item in ["sender", "receiver"]:
+        if f"{item}_norm" not in columns:
+            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN {item}_norm TEXT")
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS index_{table_name}_{item}_norm ON {table_name} ({item}_norm)"
+        )
+        cursor.execute(
+            f"UPDATE {table_name} SET {item}_norm = address_key({item}) WHERE {item}_norm IS NULL"
+        )
+    cursor.close()
+
 
 if __name__ == "__main__":
     DB_NAME1 = "msgs"
@@ -18,58 +67,56 @@ if __name__ == "__main__":
         sys.exit(1)
 
     connection = sqlite3.connect(config.sqlite_email_file)
+    connection.create_function("address_key", 1, address_key, deterministic=True)
+    start = time.time()
 
-    #Fix address book names
-    for k,v  in config.emails_dict.items():
-        find_sql = f"SELECT * FROM address_book WHERE email_addr LIKE '%{k}%'"
+    try:
         cursor = connection.cursor()
-        addr_results = cursor.execute(find_sql).fetchall()
-        for addr_address in addr_results:
-            addr_update_sql = "UPDATE address_book SET display_name = ? WHERE id = ?;"
-            cursor2 = connection.cursor()
-            try:
-                cursor2.execute(addr_update_sql, (v, addr_address[0]))
-            except sqlite3.IntegrityError as e:
-                if (
-                    hasattr(e, "sqlite_errorname")
-                    and "SQLITE_CONSTRAINT_UNIQUE" in e.sqlite_errorname
-                ):
-                    print(f"Record already exists. {e}")
-                else:
-                    print(e)
-            connection.commit()
-            cursor2.close()
-
-    console.print("Updating display names for email addresses in database")
-
-    address_sql = sql = "SELECT * FROM address_book;"
-    cursor = connection.cursor()
-    for address in cursor.execute(sql):
-        pretty_entry = f"{address[2]} <{address[1]}>"
-        console.print(pretty_entry)
+        # Fix address book names
+        cursor.execute("CREATE TEMP TABLE my_names (email_norm TEXT PRIMARY KEY, display_name TEXT)")
+        cursor.executemany(
+            "INSERT OR REPLACE INTO temp.my_names (email_norm, display_name) VALUES (?, ?)",
+            [(normalize_address(k), v) for k, v in config.emails_dict.items()],
+        )
+        cursor.execute(
+            """UPDATE address_book SET display_name = n.display_name
+            FROM temp.my_names n
+            WHERE address_key(address_book.email_addr) = n.email_norm
+            AND address_book.display_name IS NOT n.display_name"""
+        )
+        console.print(f"{cursor.rowcount} of your addresses renamed in address_book")
+
+        console.print("Updating display names for email addresses in database")
+        add_norm_columns(connection=connection, table_name=DB_NAME1)
+
+        # One name per address. If an address is in the book more than once the
+        # newest entry wins, like the old row by row loop. Addresses without a
+        # name are left alone.
+        cursor.execute("CREATE TEMP TABLE pretty_names (email_norm TEXT PRIMARY KEY, pretty_entry TEXT)")
+        cursor.execute(
+            """INSERT OR REPLACE INTO temp.pretty_names (email_norm, pretty_entry)
+            SELECT address_key(email_addr), display_name || ' <' || email_addr || '>'
+            FROM address_book
+            WHERE email_addr IS NOT NULL AND coalesce(display_name, '') != ''
+            ORDER BY id"""
+        )
 
         for item in ["sender", "receiver"]:
-            console.print(f"Doing {item}")
-            find_sql = f"SELECT * FROM {DB_NAME1} WHERE {item} LIKE '%{address[1]}%'"
-            print(find_sql)            
-            cursor = connection.cursor()
-            results = cursor.execute(find_sql).fetchall()
-            console.print(f"{len(results)} records found.")
-            for email_msg in results:
-                sys.stdout.write("Updating record: %d  \r" % (email_msg[0]))
-                sys.stdout.flush()
-                cursor2 = connection.cursor()
-                update_sql = f"UPDATE {DB_NAME1} SET {item} = ? WHERE id = ?;"
-                try:
-                    cursor2.execute(update_sql, (pretty_entry, email_msg[0]))
-                except sqlite3.IntegrityError as e:
-                    if (
-                        hasattr(e, "sqlite_errorname")
-                        and "SQLITE_CONSTRAINT_UNIQUE" in e.sqlite_errorname
-                    ):
-                        print(f"Record already exists. {e}")
-                    else:
-                        print(e)
-                connection.commit()
-                cursor2.close()
+            cursor.execute(
+                f"""UPDATE {DB_NAME1} SET {item} = p.pretty_entry
+                FROM temp.pretty_names p
+                WHERE {DB_NAME1}.{item}_norm = p.email_norm
+                AND {DB_NAME1}.{item} IS NOT p.pretty_entry"""
+            )
+            console.print(f"{item}: {cursor.rowcount} records updated.")
+        connection.commit()
+    except sqlite3.Error as e:
+        connection.rollback()
+        print(e)
+        sys.exit(1)
+    finally:
+        connection.execute("DROP TABLE IF EXISTS temp.my_names")
+        connection.execute("DROP TABLE IF EXISTS temp.pretty_names")
 
+    console.print(f"Done in {time.time() - start:.1f}s")
+    connection.close()
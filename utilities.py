@@ -1,19 +1,48 @@
 import json
 import os
 import re
+import threading
 import time
 import unicodedata
 from email_validator import validate_email, EmailNotValidError
 
-from typing import List, Tuple
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
 from dateutil.parser import parse
 from email.utils import getaddresses
 
+import httpx
 from langchain.docstore.document import Document
-from langchain_ollama import OllamaEmbeddings
+from langchain_core.embeddings import Embeddings
+from langchain_ollama import ChatOllama, OllamaEmbeddings
 
 import config
 import utilities
+from llm_cache import bind_llm_cache
+
+# Parsed To/From header pairs kept by AddressCache.
+ADDRESS_CACHE_SIZE = 50000
+
+# Keep-alive connections kept open per Ollama URL by the client registry.
+HTTP_POOL_SIZE = 16
+HTTP_KEEPALIVE_SECONDS = 300
+
+# Rough characters per token for English text, good enough for prompt budgets
+# without loading the model's tokenizer.
+CHARS_PER_TOKEN = 4
+
+# Used when config.py doesn't define email_cut_rules. See config-example.py.
+DEFAULT_CUT_RULES = {
+    "Original Message": r".*--.*Original Message.*--.*",
+    "On...wrote:": r"On.*wrote:",
+    "Forward Message": r".*--.*Forwarded Message.*--.*",
+    "sig": r"--",
+    "m!": r"m!",
+    "ttul": r"ttul,$",
+    "k;": r"k;",
+    "Cheers": r"Cheers$",
+}
 
 
 def remove_blank_lines(input_string):
@@ -26,6 +55,130 @@ def remove_blank_lines(input_string):
     return result
 
 
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def cut_point(line: str, max_chars: int) -> int:
+    """
+    Where to cut a line longer than max_chars: after the last sentence end in
+    the second half of the first max_chars, or else the last space there.
+    Mid-word only if there's neither, e.g. a long URL.
+    """
+    window = line[:max_chars]
+    for pattern in (r"[.!?][\"')]*\s+", r"\s+"):
+        ends = [match.end() for match in re.finditer(pattern, window)]
+        if ends and ends[-1] > max_chars // 2:
+            return ends[-1]
+    return max_chars
+
+
+def split_to_token_budget(
+    text: str, max_tokens: int, max_chunks: int = 1
+) -> Tuple[List[str], int]:
+    """
+    Splits text into chunks of about max_tokens each, on line breaks where it
+    can. A line longer than a chunk (1.0 stores bodies without line breaks)
+    is cut after a sentence, or else at a space. Anything past max_chunks
+    chunks is dropped. max_tokens 0 (or None) keeps the text whole.
+
+    Returns:
+        tuple: The chunks (just [text] if it fits) and the estimated tokens dropped.
+    """
+    if not max_tokens or estimate_tokens(text) <= max_tokens:
+        return [text], 0
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    chunks = []
+    current = ""
+    for line in text.splitlines(keepends=True):
+        while len(line) > max_chars:
+            if current:
+                chunks.append(current)
+                current = ""
+            cut = cut_point(line, max_chars)
+            chunks.append(line[:cut])
+            line = line[cut:]
+        if current and len(current) + len(line) > max_chars:
+            chunks.append(current)
+            current = ""
+        current += line
+    if current:
+        chunks.append(current)
+    dropped = sum(estimate_tokens(chunk) for chunk in chunks[max_chunks:])
+    return chunks[:max_chunks], dropped
+
+
+def merge_json_objects(objects: List[dict]) -> dict:
+    """
+    Merges JSON objects from several LLM answers. Keys found in more than one
+    object get a list of all their values.
+    """
+    merged = {}
+    for obj in objects:
+        for key, value in obj.items():
+            if key not in merged:
+                merged[key] = value
+                continue
+            existing = merged[key] if isinstance(merged[key], list) else [merged[key]]
+            merged[key] = existing + (value if isinstance(value, list) else [value])
+    return merged
+
+
+class SignatureStripper:
+    """
+    Cuts an email body at the first line that starts a signature, quoted reply
+    or forward, and drops everything after it.
+
+    All the rules are compiled into one multiline pattern, so the body is
+    scanned once. Each rule is a regex matched at the start of a line, like
+    re.match on that line. Rules shouldn't use numbered backreferences.
+    Inline flags at the start of a rule, like (?i), only apply to that rule.
+    """
+
+    def __init__(self, rules: dict = None):
+        if rules is None:
+            rules = getattr(config, "email_cut_rules", DEFAULT_CUT_RULES)
+        self.rule_names = list(rules)
+        alternatives = "|".join(
+            f"(?P<rule{count}>{self.scoped(name, pattern)})"
+            for count, (name, pattern) in enumerate(rules.items())
+        )
+        self.pattern = re.compile(f"^(?:{alternatives})", re.MULTILINE)
+
+    @staticmethod
+    def scoped(name: str, pattern: str) -> str:
+        """
+        A rule ready to be joined with the others. Leading global flags such as
+        (?i) would apply to the whole joined pattern and Python rejects them
+        anywhere but the start, so they become a (?i:...) group.
+        """
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            raise ValueError(f"email_cut_rules {name!r}: bad regex {pattern!r}: {e}") from e
+        flags = re.match(r"\(\?([aiLmsux]+)\)", pattern)
+        if flags is None:
+            return pattern
+        if set(flags.group(1)) & set("aLu"):
+            raise ValueError(
+                f"email_cut_rules {name!r}: only the i, m, s and x inline flags are supported, not {flags.group(0)}"
+            )
+        return f"(?{flags.group(1)}:{pattern[flags.end():]})"
+
+    def strip(self, text: str) -> Tuple[str, str]:
+        """
+        Returns:
+            tuple: The text before the first cut line, and the name of the rule
+            that matched (None if nothing matched).
+        """
+        match = self.pattern.search(text)
+        if not match:
+            return text, None
+        rule_name = self.rule_names[int(match.lastgroup[4:])]
+        # Drop the newline that ended the last kept line too.
+        return text[: max(match.start() - 1, 0)], rule_name
+
+
 def save_doc(doc, file_path=False):
     with open(file_path, "w") as f:
         f.write(doc.json())
@@ -76,12 +229,25 @@ def parse_people(message: dict) -> Tuple[str, str]:
 
     return sender, receiver
 
-def parse_people2(message: dict) -> Tuple[str, str]:
+def validate_address(email_addr: str) -> Optional[str]:
+    """Returns None if email_addr is valid, otherwise the reason it isn't."""
+    try:
+        validate_email(email_addr, check_deliverability=False)
+    except EmailNotValidError as e:
+        # The exception message is human-readable explanation of why it's
+        # not a valid (or deliverable) email address.
+        return str(e)
+    return None
+
+
+def parse_addresses(
+    to_header: str, from_header: str, validate=validate_address
+) -> Tuple[list, list]:
     # These are not useful messages generally
     junk = ["undisclosed", "suppressed", "[*to]"]
 
-    receiver = clean_address_list(getaddresses([message.get('to','')]))
-    sender = clean_address_list(getaddresses([message.get('from','')]))
+    receiver = clean_address_list(getaddresses([to_header]))
+    sender = clean_address_list(getaddresses([from_header]))
 
     #Email is such dirty data.
     if len(receiver) <= 1:
@@ -94,22 +260,123 @@ def parse_people2(message: dict) -> Tuple[str, str]:
         if not sender or any(x in sender[0][1].lower() for x in junk) or sender[0][1].count("<") > 1:
             sender = [("Junk Sender", "broked_sender@example.com")]
 
-    try:
-        emailinfo = validate_email(sender[0][1], check_deliverability=False)
-        # email = emailinfo.normalized
-        # print(email)
-    except EmailNotValidError as e:
-    # The exception message is human-readable explanation of why it's
-    # not a valid (or deliverable) email address.
-        print(str(e))
+    error = validate(sender[0][1])
+    if error is not None:
+        print(error)
         sender = [("Junk Receiver", "broked_receiver@example.com")]
 
-    # print(f"Util: From {message['From']} -> {sender}")
-    # print(f"Util: To {message['To']} -> {receiver}")
+    # print(f"Util: From {from_header} -> {sender}")
+    # print(f"Util: To {to_header} -> {receiver}")
 
     return sender, receiver
 
 
+def parse_people2(message: dict, address_cache=None) -> Tuple[list, list]:
+    if address_cache is not None:
+        return address_cache.parse_people(message)
+    return parse_addresses(
+        str(message.get("to", "")), str(message.get("from", ""))
+    )
+
+
+class AddressCache:
+    """
+    Memoizes parse_people2. Parsed results are kept in a bounded LRU keyed on
+    the raw To/From header values, and validate_email results are kept per
+    address so they can be saved to SQLite and reused by later imports.
+
+    Cached results are shared, don't modify them.
+    """
+
+    def __init__(self, maxsize: int = ADDRESS_CACHE_SIZE, validated: dict = None):
+        self.maxsize = maxsize
+        self.parsed = OrderedDict()
+        self.validated = dict(validated or {})
+        self.new_validations = {}
+        self.hits = 0
+        self.misses = 0
+        self.validation_hits = 0
+        self.validation_misses = 0
+
+    def parse_people(self, message: dict) -> Tuple[tuple, tuple]:
+        key = (str(message.get("to", "")), str(message.get("from", "")))
+        if key in self.parsed:
+            self.hits += 1
+            self.parsed.move_to_end(key)
+            return self.parsed[key]
+        self.misses += 1
+        sender, receiver = parse_addresses(*key, validate=self.validate)
+        result = (tuple(sender), tuple(receiver))
+        self.parsed[key] = result
+        if len(self.parsed) > self.maxsize:
+            self.parsed.popitem(last=False)
+        return result
+
+    def validate(self, email_addr: str) -> Optional[str]:
+        if email_addr in self.validated:
+            self.validation_hits += 1
+            return self.validated[email_addr]
+        self.validation_misses += 1
+        error = validate_address(email_addr)
+        self.validated[email_addr] = error
+        self.new_validations[email_addr] = error
+        return error
+
+    def drain(self) -> dict:
+        """Hands back the counters and new validations since the last drain. For pool workers."""
+        delta = {
+            "hits": self.hits,
+            "misses": self.misses,
+            "validation_hits": self.validation_hits,
+            "validation_misses": self.validation_misses,
+            "validated": self.new_validations,
+        }
+        self.hits = self.misses = self.validation_hits = self.validation_misses = 0
+        self.new_validations = {}
+        return delta
+
+    def merge(self, delta: dict):
+        self.hits += delta["hits"]
+        self.misses += delta["misses"]
+        self.validation_hits += delta["validation_hits"]
+        self.validation_misses += delta["validation_misses"]
+        self.validated.update(delta["validated"])
+        self.new_validations.update(delta["validated"])
+
+    def load(self, connection, table_name: str = "address_validation"):
+        cursor = connection.cursor()
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {table_name} (email_addr TEXT PRIMARY KEY, error TEXT)"
+        )
+        self.validated.update(cursor.execute(f"SELECT email_addr, error FROM {table_name}"))
+        cursor.close()
+
+    def save(self, connection, table_name: str = "address_validation") -> int:
+        cursor = connection.cursor()
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {table_name} (email_addr TEXT PRIMARY KEY, error TEXT)"
+        )
+        cursor.executemany(
+            f"INSERT OR REPLACE INTO {table_name} (email_addr, error) VALUES (?, ?)",
+            self.new_validations.items(),
+        )
+        connection.commit()
+        cursor.close()
+        saved = len(self.new_validations)
+        self.new_validations = {}
+        return saved
+
+    def report(self) -> List[str]:
+        lookups = self.hits + self.misses
+        validations = self.validation_hits + self.validation_misses
+        return [
+            f"Address cache: {self.hits} hits, {self.misses} misses"
+            f" ({self.hits / lookups:.1%} hit rate)" if lookups else "Address cache: unused",
+            f"Validation cache: {self.validation_hits} hits, {self.validation_misses} misses"
+            f" ({self.validation_hits / validations:.1%} hit rate)" if validations else "Validation cache: unused",
+        ]
+
+
 def timer(func):
     def wrap_the_func():
         start_time = time.perf_counter()
@@ -123,6 +390,47 @@ def timer(func):
     return wrap_the_func
 
 
+def run_bounded(func: Callable, items: Iterable, concurrency: int = 1) -> Iterator:
+    """
+    Calls func on each item in a thread pool, with at most `concurrency` calls in
+    flight, and yields the results as they complete (not in input order).
+    items is only read as fast as results come back, so it can be a generator
+    over a big table. With concurrency 1 it's a plain loop.
+    """
+    if concurrency <= 1:
+        for item in items:
+            yield func(item)
+        return
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        in_flight = set()
+        for item in items:
+            if len(in_flight) >= concurrency:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            in_flight.add(executor.submit(func, item))
+        while in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def retry_call(func: Callable, *args, retries: int = 2, backoff: float = 2.0, **kwargs):
+    """
+    Calls func, retrying on any exception up to `retries` more times with
+    exponential backoff. The last exception is raised if every try fails.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            if attempt == retries:
+                raise
+            delay = backoff * 2**attempt
+            print(f"{e.__class__.__name__}: {e}. Retrying in {delay:.0f}s")
+            time.sleep(delay)
+
+
 def load_json(file_path: str):
     with open(file_path, "r") as file:
         # Load the JSON data from the file
@@ -204,13 +512,141 @@ def table_exists(connection, table_name):
     return result is not None
 
 
-def embed_str(data_point: str) -> List[str]:
-    embedding_llm = OllamaEmbeddings(
-        model=config.llm_embeddings_model,
-        base_url=config.llm_url,
+# Client registry. Building an LLM client means a new HTTP client and, for the
+# first request, a new TCP connection. These hand out one long-lived client per
+# (model, URL, options) instead, and the clients for a URL share one keep-alive
+# connection pool (langchain-ollama 0.3+). The clients are thread safe.
+_clients = {}
+_transports = {}
+_clients_lock = threading.Lock()
+
+
+def http_transport(base_url: str) -> httpx.HTTPTransport:
+    """The shared keep-alive connection pool for an Ollama URL."""
+    with _clients_lock:
+        if base_url not in _transports:
+            _transports[base_url] = httpx.HTTPTransport(
+                limits=httpx.Limits(
+                    max_connections=HTTP_POOL_SIZE,
+                    max_keepalive_connections=HTTP_POOL_SIZE,
+                    keepalive_expiry=HTTP_KEEPALIVE_SECONDS,
+                )
+            )
+        return _transports[base_url]
+
+
+def _client_kwargs(client_class, base_url: str, timeout: float = None) -> dict:
+    """
+    HTTP settings for a langchain_ollama client. langchain-ollama 0.3+ takes
+    separate sync client settings, which is where the shared pool goes. On
+    older versions each client keeps its own keep-alive pool.
+    """
+    kwargs = {"client_kwargs": {"timeout": timeout}}
+    if "sync_client_kwargs" in getattr(client_class, "model_fields", {}):
+        kwargs["sync_client_kwargs"] = {"transport": http_transport(base_url)}
+    return kwargs
+
+
+def _get_client(key: tuple, build: Callable):
+    with _clients_lock:
+        client = _clients.get(key)
+    if client is None:
+        client = build()
+        with _clients_lock:
+            # Another thread may have beaten us to it, keep theirs.
+            client = _clients.setdefault(key, client)
+    return client
+
+
+def get_chat_model(
+    model: str, base_url: str = None, timeout: float = None, **options
+) -> ChatOllama:
+    """
+    A shared ChatOllama for model at base_url (config.llm_url by default).
+    options are passed to ChatOllama, e.g. keep_alive=-1, and are part of the key.
+    Uses the LLM cache if enable_llm_cache() was called, before or after.
+    """
+    base_url = base_url or config.llm_url
+    key = ("chat", model, base_url, timeout, tuple(sorted(options.items())))
+    llm = _get_client(
+        key,
+        lambda: ChatOllama(
+            model=model,
+            base_url=base_url,
+            **_client_kwargs(ChatOllama, base_url, timeout),
+            **options,
+        ),
     )
+    return bind_llm_cache(llm)
+
+
+# The prefixes langchain_community's OllamaEmbeddings put in front of every
+# text. Collections built with it only match vectors made the same way.
+EMBED_INSTRUCTION = "passage: "
+QUERY_INSTRUCTION = "query: "
+
+
+class PrefixedEmbeddings(Embeddings):
+    """Embeddings with EMBED_INSTRUCTION/QUERY_INSTRUCTION put in front, like langchain_community's."""
+
+    def __init__(self, embeddings: Embeddings):
+        self.embeddings = embeddings
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents([f"{EMBED_INSTRUCTION}{text}" for text in texts])
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(f"{QUERY_INSTRUCTION}{text}")
+
+
+def get_embeddings(model: str = None, base_url: str = None, prefixed: bool = False) -> Embeddings:
+    """
+    A shared OllamaEmbeddings, config.llm_embeddings_model by default. prefixed
+    wraps it in PrefixedEmbeddings, for the scripts whose stored vectors were
+    made with langchain_community's OllamaEmbeddings.
+    """
+    model = model or config.llm_embeddings_model
+    base_url = base_url or config.llm_url
+    embeddings = _get_client(
+        ("embeddings", model, base_url),
+        lambda: OllamaEmbeddings(
+            model=model,
+            base_url=base_url,
+            **_client_kwargs(OllamaEmbeddings, base_url),
+        ),
+    )
+    return PrefixedEmbeddings(embeddings) if prefixed else embeddings
+
+
+def get_graph_transformer(model: str = None, base_url: str = None, **options):
+    """
+    A shared LLMGraphTransformer on OllamaFunctions, config.llm_relationship_model
+    by default. options go to LLMGraphTransformer. Needs langchain-experimental.
+    """
+    from langchain_experimental.graph_transformers import LLMGraphTransformer
+    from langchain_experimental.llms.ollama_functions import OllamaFunctions
+
+    model = model or config.llm_relationship_model
+    base_url = base_url or config.llm_url
+    return _get_client(
+        ("graph", model, base_url, tuple(sorted(options.items()))),
+        lambda: LLMGraphTransformer(
+            llm=_get_client(
+                ("functions", model, base_url),
+                lambda: OllamaFunctions(model=model, base_url=base_url),
+            ),
+            **options,
+        ),
+    )
+
+
+def embed_str(data_point: str) -> List[str]:
+    return get_embeddings().embed_query(data_point)
+
 
-    return embedding_llm.embed_query(data_point)
+def normalize_address(email_addr: str) -> str:
+    """Lowercase, trimmed form of an address. Matches lower(trim(...)) in SQLite for ASCII addresses."""
+    return (email_addr or "").strip().lower()
 
 
 def clean_address_list(address_tuples):